@@ -0,0 +1,143 @@
+"""
+Benchmark plugin actions against the synthetic Midarr server.
+
+Every action runs in a fresh interpreter with an empty add-on profile, like a
+cold Kodi invocation, against a server holding the given number of movies
+(series are a tenth of that, each with 3 seasons of 10 episodes). The script
+reports per action and size:
+
+    wall      time the action took in milliseconds
+    requests  HTTP requests the server received
+    peak      peak resident memory of the interpreter in MB
+
+Usage:
+    python3 benchmarks/actions.py [--sizes 1000,10000,100000] [--latency-ms 0]
+                                  [--actions list_videos,search] [--json results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from server import SyntheticServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUBS = os.path.join(HERE, 'stubs')
+ADDON = os.path.abspath(os.path.join(HERE, '..', 'repo', 'plugin.video.midarr'))
+
+SEARCH_QUERY = 'Movie 12'
+ACTIONS = {
+    'list_videos': lambda addon: addon.list_videos('movies', page=1),
+    'list_episodes': lambda addon: addon.list_episodes(itemid=1, season=1),
+    'search': lambda addon: addon.search(),
+    'fetch_and_process_videos': lambda addon: addon.fetch_and_process_videos('movies'),
+    'fetch_and_process_series': lambda addon: addon.fetch_and_process_series('series'),
+}
+
+
+def peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def child(action):
+    sys.path[:0] = [STUBS, ADDON]
+    sys.argv = ['plugin://plugin.video.midarr/', '1', '']
+    os.chdir(ADDON)
+
+    from time import perf_counter
+
+    import addon
+    import xbmcgui
+    import xbmcplugin
+
+    start = perf_counter()
+    ACTIONS[action](addon)
+    finished = perf_counter()
+
+    print(json.dumps({
+        'wall_ms': (finished - start) * 1000,
+        'peak_mb': peak_memory_mb(),
+        'items': len(xbmcplugin.ITEMS),
+        'errors': [message for heading, message in xbmcgui.NOTIFICATIONS if heading == 'Error'],
+    }))
+
+
+def run(action, server):
+    profile = tempfile.mkdtemp(prefix='midarr-bench-')
+    env = dict(os.environ,
+               KODI_STUB_PROFILE=profile,
+               KODI_STUB_INPUT=SEARCH_QUERY,
+               KODI_STUB_SETTINGS=json.dumps({'baseurl': server.url, 'apitoken': 'benchmark'}))
+
+    try:
+        before = server.requests
+        output = subprocess.run([sys.executable, __file__, '--child', action],
+                                check=True, capture_output=True, text=True, env=env).stdout
+        result = json.loads(output.splitlines()[-1])
+        result['requests'] = server.requests - before
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated numbers of movies')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay of every server response')
+    parser.add_argument('--actions', default=','.join(ACTIONS), help='comma separated actions to run')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return child(args.child)
+
+    actions = args.actions.split(',')
+    unknown = [action for action in actions if action not in ACTIONS]
+
+    if unknown:
+        parser.error(f'unknown actions: {", ".join(unknown)}')
+
+    results = []
+    failed = False
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        server = SyntheticServer(movies=size, series=max(1, size // 10), latency=args.latency_ms / 1000).start()
+
+        try:
+            for action in actions:
+                result = run(action, server)
+                result.update(action=action, size=size, latency_ms=args.latency_ms)
+                results.append(result)
+
+                peak = f"{result['peak_mb']:8.1f} MB" if result['peak_mb'] is not None else '       n/a'
+                print(f"{action:26} {size:>7}  wall {result['wall_ms']:10.1f} ms  "
+                      f"requests {result['requests']:>6}  peak {peak}")
+
+                for error in result['errors']:
+                    failed = True
+                    print(f'FAIL {action} {size}: {error}')
+        finally:
+            server.stop()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Measure plugin start-up cost against the stub Kodi modules.
+
+Kodi starts addon.py in a fresh interpreter for every navigation, so each
+sample runs in its own subprocess. Actions run addon.py as __main__, like Kodi
+does, so the tracer setup and the router are part of the start-up time; the
+'import' entry only imports the module. For every entry the script reports the
+start-up time and which modules got imported, and fails if an entry pulls in a
+module it should not need or exceeds the time budget.
+
+Usage:
+    python3 benchmarks/import_time.py [--budget-ms 30] [--runs 5]
+"""
+import argparse
+import json
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STUBS = os.path.join(HERE, 'stubs')
+ADDON = os.path.abspath(os.path.join(HERE, '..', 'repo', 'plugin.video.midarr'))
+
+# Entries measured without a server, with the modules they must not import.
+# A query of None only imports addon.py, the others run it as Kodi does.
+HEAVY = ['json', 'http.client', 'ssl', 'sqlite3', 'threading', 'concurrent.futures', 're', 'shutil']
+ACTIONS = {
+    'import': (None, HEAVY + ['xbmcgui', 'xbmcplugin', 'xbmcaddon', 'xbmcvfs']),
+    'root': ('', HEAVY + ['xbmcaddon']),
+    'play': ('action=play&video=http%3A%2F%2Fmidarr.home%2Fapi%2Fstream%3Ftoken%3Dx', HEAVY),
+}
+
+
+def child(query):
+    sys.path[:0] = [STUBS, ADDON]
+    sys.argv = ['plugin://plugin.video.midarr/', '1', f'?{query or ""}']
+
+    from time import perf_counter
+    # run_path imports it on first use, Kodi runs add-ons without it.
+    import pkgutil  # noqa: F401
+
+    before = set(sys.modules)
+    start = perf_counter()
+
+    if query is None:
+        import addon  # noqa: F401
+    else:
+        runpy.run_path(os.path.join(ADDON, 'addon.py'), run_name='__main__')
+
+    finished = perf_counter()
+
+    print(json.dumps({
+        'startup_ms': (finished - start) * 1000,
+        'modules': sorted(set(sys.modules) - before),
+    }))
+
+
+def sample(query):
+    arguments = [] if query is None else ['--query', query]
+    output = subprocess.run([sys.executable, __file__, '--child', *arguments],
+                            check=True, capture_output=True, text=True, cwd=ADDON).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=30.0, help='maximum median start-up time of an entry')
+    parser.add_argument('--runs', type=int, default=5, help='subprocess samples per entry')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--query', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.query)
+
+    failures = []
+
+    for name, (query, forbidden) in ACTIONS.items():
+        samples = [sample(query) for _ in range(args.runs)]
+        startup_ms = statistics.median(s['startup_ms'] for s in samples)
+        modules = samples[-1]['modules']
+        unexpected = [module for module in forbidden if module in modules]
+
+        print(f'{name:8} startup {startup_ms:7.2f} ms  modules {len(modules)}')
+
+        if unexpected:
+            failures.append(f'{name}: imports {", ".join(unexpected)}')
+        if startup_ms > args.budget_ms:
+            failures.append(f'{name}: start-up took {startup_ms:.2f} ms, budget is {args.budget_ms} ms')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
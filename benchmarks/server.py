@@ -0,0 +1,302 @@
+"""
+Synthetic Midarr server for benchmarks.
+
+Serves generated movies, series, episodes, search results, images and streams
+from memory. Listings are paginated like the real server, responses carry an
+ETag, are gzipped when the client asks for it and can be delayed by a fixed
+latency. Streams are a generated byte pattern with an ETag and honour range
+requests. The number of requests served is counted, so benchmarks can report
+how many round trips an action needed.
+
+Usage:
+    python3 benchmarks/server.py [--port 8765] [--movies 1000] [--series 100] [--latency-ms 0]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Items per page when the client does not ask for a page size.
+PAGE_SIZE = 50
+SEASONS = 3
+EPISODES = 10
+# Bytes of every stream when not given.
+STREAM_SIZE = 1024
+# Smallest valid PNG, served for every image.
+IMAGE = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                      '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082')
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Documentary', 'Horror', 'Science Fiction', 'Thriller']
+
+
+def movie(number):
+    return {
+        'id': number,
+        'title': f'Movie {number}',
+        'overview': f'Synthetic movie number {number} for benchmarking.',
+        'year': 1950 + number % 75,
+        'genres': [GENRES[number % len(GENRES)]],
+        'poster': f'/api/images?movie={number}&type=poster',
+        'background': f'/api/images?movie={number}&type=background',
+        'stream': f'/api/stream?movie={number}',
+    }
+
+
+def series(number, seasons=SEASONS):
+    return {
+        'id': number,
+        'title': f'Series {number}',
+        'overview': f'Synthetic series number {number} for benchmarking.',
+        'year': 1950 + number % 75,
+        'genres': [GENRES[number % len(GENRES)]],
+        'seasonCount': seasons,
+        'poster': f'/api/images?series={number}&type=poster',
+        'background': f'/api/images?series={number}&type=background',
+    }
+
+
+def episode(series_id, season, number):
+    return {
+        'id': f'{series_id}-{season}-{number}',
+        'title': f'Episode {number}',
+        'overview': f'Season {season} episode {number} of series {series_id}.',
+        'screenshot': f'/api/images?episode={series_id}-{season}-{number}',
+        'stream': f'/api/stream?episode={series_id}-{season}-{number}',
+    }
+
+
+def stream_bytes(size):
+    """
+    Content of every stream, a pattern that makes misplaced bytes show up.
+    """
+    pattern = bytes(range(251))
+
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+class SyntheticServer(ThreadingHTTPServer):
+    """
+    In-memory Midarr stand-in.
+
+    :param address: (host, port) to listen on, port 0 picks a free one
+    :param movies: number of movies
+    :param series: number of series
+    :param seasons: seasons per series
+    :param episodes: episodes per season
+    :param latency: seconds every response is delayed by
+    :param page_size: default items per listing page
+    :param stream_size: bytes of every stream
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), movies=1000, series=100, seasons=SEASONS, episodes=EPISODES,
+                 latency=0.0, page_size=PAGE_SIZE, stream_size=STREAM_SIZE):
+        super().__init__(address, Handler)
+        self.movies = movies
+        self.series = series
+        self.seasons = seasons
+        self.episodes = episodes
+        self.latency = latency
+        self.page_size = page_size
+        self.stream = stream_bytes(stream_size)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def stream(self):
+        return self._stream
+
+    @stream.setter
+    def stream(self, data):
+        # Assigned again to stand in for a file replaced on the server, e.g. by a better release.
+        self._stream = data
+        self.stream_etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def page(self, factory, total, query):
+        page = max(1, int(query.get('page', 1)))
+        size = max(1, int(query.get('per_page', self.page_size)))
+        start = (page - 1) * size
+
+        return {'items': [factory(number) for number in range(start + 1, min(total, start + size) + 1)],
+                'total': total}
+
+    def search(self, query):
+        words = query.lower().split()
+        items = []
+
+        for factory, total in ((movie, self.movies), (lambda number: series(number, self.seasons), self.series)):
+            for number in range(1, total + 1):
+                item = factory(number)
+
+                if all(word in item['title'].lower() for word in words):
+                    items.append(item)
+
+                    if len(items) >= 100:
+                        return {'items': items}
+
+        return {'items': items}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without this every response waits for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # Set by do_HEAD, the headers are sent without the body then.
+    head = False
+
+    def do_HEAD(self):
+        self.head = True
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        server.count()
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        parts = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        path = parts.path
+
+        if path == '/api/movies':
+            body = server.page(movie, server.movies, query)
+        elif path == '/api/series':
+            body = server.page(lambda number: series(number, server.seasons), server.series, query)
+        elif path.startswith('/api/series/') and path.rsplit('/', 1)[1].isdigit():
+            series_id = int(path.rsplit('/', 1)[1])
+
+            if series_id > server.series:
+                return self.send_empty(404)
+
+            if 'season' in query:
+                body = [episode(series_id, int(query['season']), number)
+                        for number in range(1, server.episodes + 1)]
+            else:
+                body = series(series_id, server.seasons)
+        elif path == '/api/search':
+            body = server.search(query.get('query', ''))
+        elif path == '/api/images':
+            return self.send_body(IMAGE, 'image/png')
+        elif path == '/api/stream':
+            return self.send_stream(server.stream, server.stream_etag)
+        else:
+            return self.send_empty(404)
+
+        self.send_json(body)
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_stream(self, data, etag):
+        ranged = self.headers.get('Range', '')
+
+        if not ranged.startswith('bytes='):
+            try:
+                return self.send_body(data, 'video/mp4', [('Accept-Ranges', 'bytes'), ('ETag', etag)])
+            except ConnectionError:
+                self.close_connection = True
+                return
+
+        first, _, last = ranged[len('bytes='):].partition('-')
+
+        if first:
+            first, last = int(first), min(int(last) if last else len(data) - 1, len(data) - 1)
+        else:
+            # The last bytes of the stream.
+            first, last = max(0, len(data) - int(last)), len(data) - 1
+
+        if first >= len(data):
+            return self.send_empty(416, [('Content-Range', f'bytes */{len(data)}')])
+
+        try:
+            self.send_body(data[first:last + 1], 'video/mp4',
+                           [('Accept-Ranges', 'bytes'), ('ETag', etag),
+                            ('Content-Range', f'bytes {first}-{last}/{len(data)}')], 206)
+        except ConnectionError:
+            # Players drop the connection when they seek.
+            self.close_connection = True
+
+    def send_body(self, data, content_type, headers=(), status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(data)
+
+    def send_json(self, body):
+        data = json.dumps(body).encode()
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_empty(304, [('ETag', etag)])
+
+        headers = [('ETag', etag)]
+
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, 1)
+            headers.append(('Content-Encoding', 'gzip'))
+
+        self.send_body(data, 'application/json', headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--series', type=int, default=100)
+    parser.add_argument('--seasons', type=int, default=SEASONS)
+    parser.add_argument('--episodes', type=int, default=EPISODES)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--stream-mb', type=float, default=STREAM_SIZE / 1024 / 1024)
+    args = parser.parse_args()
+
+    server = SyntheticServer(('127.0.0.1', args.port), movies=args.movies, series=args.series, seasons=args.seasons,
+                             episodes=args.episodes, latency=args.latency_ms / 1000, page_size=args.page_size,
+                             stream_size=int(args.stream_mb * 1024 * 1024))
+    print(f'Serving {args.movies} movies and {args.series} series on {server.url}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
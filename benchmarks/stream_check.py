@@ -0,0 +1,155 @@
+"""
+Check the read-ahead stream proxy against the synthetic server.
+
+Starts benchmarks/server.py with a generated stream and the add-on's local
+proxy in front of it, then plays the stream both directly and through the
+proxy: a start, a few seeks, a request for the end of the file and a start
+from a prefetched head. Every response is compared with the stream's bytes and
+the time to the first byte is reported. The proxy must also refuse URLs that
+are not on the server, follow redirects known from the resolve cache and not
+serve a kept head once the file on the server was replaced.
+Exits non-zero on any mismatch.
+
+Usage:
+    python3 benchmarks/stream_check.py [--stream-mb 64] [--latency-ms 100]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.request import Request, urlopen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, 'stubs'), os.path.abspath(os.path.join(HERE, '..', 'repo', 'plugin.video.midarr'))]
+
+from server import SyntheticServer, stream_bytes  # noqa: E402
+from resources.lib.client import Client  # noqa: E402
+from resources.lib.proxy import LocalProxy  # noqa: E402
+from resources.lib.readahead import Streams  # noqa: E402
+from urllib.error import HTTPError  # noqa: E402
+from urllib.parse import urlencode  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def fetch(url, first=None, length=None, suffix=None):
+    """
+    Time to the first byte and the bytes of a (range) request.
+    """
+    headers = {}
+
+    if suffix is not None:
+        headers['Range'] = f'bytes=-{suffix}'
+    elif first is not None:
+        headers['Range'] = f"bytes={first}-{'' if length is None else first + length - 1}"
+
+    started = time.monotonic()
+
+    with urlopen(Request(url, headers=headers), timeout=30) as response:
+        data = response.read(1)
+        first_byte = time.monotonic() - started
+        data += response.read()
+
+    return first_byte, data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stream-mb', type=int, default=64)
+    parser.add_argument('--latency-ms', type=float, default=100.0)
+    parser.add_argument('--window-mb', type=int, default=32)
+    parser.add_argument('--head-mb', type=int, default=4)
+    args = parser.parse_args()
+
+    expected = stream_bytes(args.stream_mb * MB)
+    server = SyntheticServer(latency=args.latency_ms / 1000, stream_size=len(expected)).start()
+    streams = Streams(tempfile.mkdtemp(), args.window_mb * MB, args.head_mb * MB)
+    client = Client(server.url, 'x')
+    direct = f'{server.url}/api/stream?movie=1&token=x'
+    # Stands in for the resolve cache, the server itself answers 404 for this path.
+    redirects = {f'{server.url}/api/moved?movie=1&token=x': direct}
+    proxy = LocalProxy(0, lambda: client, lambda: None, tempfile.mkdtemp(), streams=streams,
+                       redirect_target=redirects.get)
+    proxy.start()
+
+    proxied = f"{proxy.url}/stream?{urlencode({'url': direct})}"
+    random.seed(1)
+    # Kodi reads a little from each position, the seeks stay inside the read-ahead window.
+    seeks = sorted(random.randrange(0, args.window_mb * MB // 2) for _ in range(3))
+    steps = [('start', dict(first=0, length=MB))]
+    steps += [(f'seek {offset // 1024} KiB', dict(first=offset, length=256 * 1024)) for offset in seeks]
+    steps += [('end 64 KiB', dict(suffix=64 * 1024))]
+    failures = []
+
+    try:
+        for name, request in steps:
+            timings = []
+
+            for url in (direct, proxied):
+                first_byte, data = fetch(url, **request)
+                first = request.get('first', len(expected) - request.get('suffix', 0))
+                length = request.get('length') or len(expected) - first
+                timings.append(first_byte * 1000)
+
+                if data != expected[first:first + length]:
+                    failures.append(f'{name}: {url} returned the wrong bytes')
+
+            print(f'{name:20} direct {timings[0]:7.1f} ms  proxy {timings[1]:7.1f} ms')
+
+        # A title seen in a listing, its head is kept before it is played.
+        other = f'{server.url}/api/stream?movie=2&token=x'
+        streams.prefetch(other)
+        timings = []
+
+        for url in (other, f"{proxy.url}/stream?{urlencode({'url': other})}"):
+            first_byte, data = fetch(url, first=0, length=MB)
+            timings.append(first_byte * 1000)
+
+            if data != expected[:MB]:
+                failures.append(f'prefetched start: {url} returned the wrong bytes')
+
+        print(f"{'prefetched start':20} direct {timings[0]:7.1f} ms  proxy {timings[1]:7.1f} ms")
+
+        first_byte, data = fetch(proxied)
+        if data != expected:
+            failures.append('whole stream: the proxy returned the wrong bytes')
+
+        first_byte, data = fetch(f"{proxy.url}/stream?{urlencode({'url': next(iter(redirects))})}", first=0, length=MB)
+        if data != expected[:MB]:
+            failures.append('redirect: the proxy did not follow the cached redirect')
+
+        # The same size, but a different file, e.g. a better release. It is
+        # played later, once the idle readers holding the old one are closed.
+        upgraded = bytes(reversed(expected))
+        server.stream = upgraded
+        streams.close()
+
+        for name, request in (('upgraded start', dict(first=0, length=2 * args.head_mb * MB)),
+                              ('upgraded again', dict(first=0, length=2 * args.head_mb * MB)),
+                              ('upgraded end', dict(suffix=64 * 1024))):
+            first_byte, data = fetch(f"{proxy.url}/stream?{urlencode({'url': other})}", **request)
+            first = request.get('first', len(upgraded) - request.get('suffix', 0))
+            if data != upgraded[first:first + request.get('length', len(upgraded))]:
+                failures.append(f'{name}: the proxy joined the old head to the new file')
+
+        for route in ('stream', 'prefetch'):
+            try:
+                fetch(f"{proxy.url}/{route}?{urlencode({'url': 'http://127.0.0.2:1/api/stream?movie=1'})}")
+                failures.append(f'{route}: the proxy fetched from another host')
+            except HTTPError as e:
+                if e.code != 404:
+                    failures.append(f'{route}: another host answered {e.code} instead of 404')
+    finally:
+        proxy.stop()
+        server.stop()
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
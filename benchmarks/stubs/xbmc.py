@@ -0,0 +1,59 @@
+"""
+Stub of Kodi's xbmc module for running the add-on outside Kodi.
+"""
+import sys
+import time
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+LOGFATAL = 4
+
+# Minimum level written to stderr.
+LOG_LEVEL = LOGWARNING
+
+# Built-in functions executed by the add-on, e.g. UpdateLibrary(video).
+BUILTINS = []
+
+
+def log(msg, level=LOGDEBUG):
+    if level >= LOG_LEVEL:
+        print(f'[xbmc] {msg}', file=sys.stderr)
+
+
+def executebuiltin(function, wait=False):
+    BUILTINS.append(function)
+
+
+def getCondVisibility(condition):
+    return False
+
+
+def getInfoLabel(label):
+    return {'System.BuildVersion': '20.2 (20.2.0) Git:stub'}.get(label, '')
+
+
+def getGlobalIdleTime():
+    return 0
+
+
+def sleep(milliseconds):
+    time.sleep(milliseconds / 1000)
+
+
+class Monitor:
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=0):
+        time.sleep(timeout or 0)
+        return False
+
+
+class Player:
+    def isPlaying(self):
+        return False
+
+    def isPlayingVideo(self):
+        return False
@@ -0,0 +1,80 @@
+"""
+Stub of Kodi's xbmcaddon module.
+
+Settings default to the values in the add-on's resources/settings.xml and can be
+overridden through SETTINGS or the KODI_STUB_SETTINGS environment variable
+(JSON object). The profile directory is taken from KODI_STUB_PROFILE.
+"""
+import json
+import os
+import tempfile
+from xml.etree import ElementTree
+
+ADDON_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'repo', 'plugin.video.midarr'))
+PROFILE = os.environ.get('KODI_STUB_PROFILE', os.path.join(tempfile.gettempdir(), 'plugin.video.midarr'))
+
+
+def _defaults():
+    defaults = {}
+
+    for setting in ElementTree.parse(os.path.join(ADDON_PATH, 'resources', 'settings.xml')).iter('setting'):
+        default = setting.find('default')
+
+        if default is not None:
+            defaults[setting.get('id')] = default.text or ''
+
+    return defaults
+
+
+SETTINGS = _defaults()
+SETTINGS.update(json.loads(os.environ.get('KODI_STUB_SETTINGS', '{}')))
+
+
+class Settings:
+    def getString(self, id):
+        return str(SETTINGS.get(id, ''))
+
+    def getInt(self, id):
+        return int(SETTINGS.get(id) or 0)
+
+    def getBool(self, id):
+        return str(SETTINGS.get(id, '')).lower() in ('true', '1')
+
+    def setString(self, id, value):
+        SETTINGS[id] = value
+
+    def setInt(self, id, value):
+        SETTINGS[id] = value
+
+    def setBool(self, id, value):
+        SETTINGS[id] = 'true' if value else 'false'
+
+
+class Addon:
+    def __init__(self, id=None):
+        pass
+
+    def getSettings(self):
+        return Settings()
+
+    def getSetting(self, id):
+        return Settings().getString(id)
+
+    def getSettingBool(self, id):
+        return Settings().getBool(id)
+
+    def getSettingInt(self, id):
+        return Settings().getInt(id)
+
+    def getLocalizedString(self, id):
+        return str(id)
+
+    def getAddonInfo(self, id):
+        return {
+            'id': 'plugin.video.midarr',
+            'name': 'Midarr',
+            'path': ADDON_PATH,
+            'profile': PROFILE,
+            'version': '0.0.0',
+        }[id]
@@ -0,0 +1,115 @@
+"""
+Stub of Kodi's xbmcgui module.
+"""
+import os
+
+INPUT_ALPHANUM = 0
+NOTIFICATION_INFO = 'info'
+NOTIFICATION_WARNING = 'warning'
+NOTIFICATION_ERROR = 'error'
+
+# Text returned by Dialog.input, e.g. the search query.
+INPUT = os.environ.get('KODI_STUB_INPUT', '')
+# Notifications shown by the add-on.
+NOTIFICATIONS = []
+# Window properties by window id.
+WINDOW_PROPERTIES = {}
+
+
+class InfoTagVideo:
+    def __init__(self):
+        self.info = {}
+
+    def __getattr__(self, name):
+        if not name.startswith('set'):
+            raise AttributeError(name)
+
+        def setter(*args):
+            self.info[name[3:]] = args[0] if len(args) == 1 else args
+
+        return setter
+
+
+class ListItem:
+    def __init__(self, label='', label2='', path='', offscreen=False):
+        self.label = label
+        self.label2 = label2
+        self.path = path
+        self.offscreen = offscreen
+        self.art = {}
+        self.properties = {}
+        self.mimetype = None
+        self.content_lookup = True
+        self._info_tag = InfoTagVideo()
+
+    def getLabel(self):
+        return self.label
+
+    def setLabel(self, label):
+        self.label = label
+
+    def setArt(self, art):
+        self.art.update(art)
+
+    def getArt(self, key):
+        return self.art.get(key, '')
+
+    def setPath(self, path):
+        self.path = path
+
+    def getPath(self):
+        return self.path
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+    def setMimeType(self, mimetype):
+        self.mimetype = mimetype
+
+    def setContentLookup(self, enable):
+        self.content_lookup = enable
+
+    def getVideoInfoTag(self):
+        return self._info_tag
+
+
+class Window:
+    def __init__(self, existingWindowId=-1):
+        self.properties = WINDOW_PROPERTIES.setdefault(existingWindowId, {})
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+    def clearProperty(self, key):
+        self.properties.pop(key, None)
+
+
+class Dialog:
+    def input(self, heading, defaultt='', type=INPUT_ALPHANUM, option=0, autoclose=0):
+        return INPUT
+
+    def notification(self, heading, message, icon=NOTIFICATION_INFO, time=5000, sound=True):
+        NOTIFICATIONS.append((heading, message))
+
+
+class DialogProgressBG:
+    def __init__(self):
+        self.percent = 0
+
+    def create(self, heading, message=''):
+        pass
+
+    def update(self, percent=0, heading='', message=''):
+        self.percent = percent
+
+    def isFinished(self):
+        return False
+
+    def close(self):
+        pass
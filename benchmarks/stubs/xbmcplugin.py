@@ -0,0 +1,46 @@
+"""
+Stub of Kodi's xbmcplugin module, recording what the add-on hands to Kodi.
+"""
+SORT_METHOD_NONE = 0
+SORT_METHOD_LABEL = 1
+SORT_METHOD_LABEL_IGNORE_THE = 2
+SORT_METHOD_VIDEO_YEAR = 3
+
+# (url, listitem, is_folder) tuples of the current directory.
+ITEMS = []
+SORT_METHODS = []
+# Result of the last endOfDirectory / setResolvedUrl call.
+RESULT = {}
+
+
+def reset():
+    del ITEMS[:]
+    del SORT_METHODS[:]
+    RESULT.clear()
+
+
+def setContent(handle, content):
+    RESULT['content'] = content
+
+
+def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+    ITEMS.append((url, listitem, isFolder))
+    return True
+
+
+def addDirectoryItems(handle, items, totalItems=0):
+    ITEMS.extend(items)
+    return True
+
+
+def addSortMethod(handle, sortMethod, labelMask='', label2Mask=''):
+    SORT_METHODS.append(sortMethod)
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+    RESULT['succeeded'] = succeeded
+
+
+def setResolvedUrl(handle, succeeded, listitem):
+    RESULT['succeeded'] = succeeded
+    RESULT['resolved'] = listitem
@@ -1,28 +1,228 @@
 """
 Compatible with Kodi 20.x "Nexus"
+
+Kodi starts this script from scratch for every folder navigation, so only the
+modules an action actually needs are imported, inside the functions using them.
 """
-import os
 import sys
-
-import xbmcgui
-import xbmcplugin
-import xbmcaddon
-import json
-import urllib.request
+from functools import lru_cache
 from urllib.parse import urlencode, parse_qsl
-import xbmc
-import threading
-import time
-import xbmcvfs
-import re
-import shutil
 
 # Get the plugin url in plugin:// notation.
 URL = sys.argv[0]
-# Get a plugin handle as an integer number.
-HANDLE = int(sys.argv[1])
+# Get a plugin handle as an integer number, the sync service imports this module without one.
+HANDLE = int(sys.argv[1]) if len(sys.argv) > 1 else -1
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """
+    Addon settings, loaded on first use.
+    """
+    import xbmcaddon
+
+    return xbmcaddon.Addon().getSettings()
+
+
+@lru_cache(maxsize=None)
+def get_profile():
+    """
+    Addon profile directory for generated files and local state.
+    """
+    import xbmcaddon
+    import xbmcvfs
+
+    return xbmcvfs.translatePath(xbmcaddon.Addon().getAddonInfo('profile'))
+
+
+@lru_cache(maxsize=None)
+def get_tracer():
+    """
+    Performance tracer, records nothing unless tracing is enabled in the settings.
+
+    :rtype: resources.lib.trace.Tracer
+    """
+    from resources.lib.trace import NULL_TRACER, Tracer
+
+    if not get_settings().getBool('tracing'):
+        return NULL_TRACER
+
+    import os
+    import platform
+    import xbmc
+    import xbmcaddon
+
+    return Tracer(os.path.join(get_profile(), 'trace.jsonl'), context={
+        'addon': xbmcaddon.Addon().getAddonInfo('version'),
+        'kodi': xbmc.getInfoLabel('System.BuildVersion'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+    })
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """
+    Shared Midarr API client, connections are kept alive across calls.
+    """
+    from resources.lib.client import Client
 
-SETTINGS = xbmcaddon.Addon().getSettings()
+    settings = get_settings()
+
+    return Client(settings.getString('baseurl'), settings.getString('apitoken'),
+                  deadline=max(1, settings.getInt('deadline')), hedge=settings.getBool('hedging'),
+                  concurrency=max(1, settings.getInt('concurrency')), tracer=get_tracer(),
+                  scheduler=get_scheduler())
+
+
+@lru_cache(maxsize=None)
+def get_scheduler():
+    """
+    Paces every request this process sends to the server, see resources.lib.scheduler.
+    """
+    import os
+    from resources.lib.scheduler import RequestScheduler
+
+    settings = get_settings()
+
+    return RequestScheduler(rate=settings.getInt('ratelimit'), max_window=max(1, settings.getInt('concurrency')),
+                            marker=os.path.join(get_profile(), 'foreground'))
+
+
+@lru_cache(maxsize=None)
+def get_cache():
+    """
+    Responses for browsing are cached on disk between plugin invocations.
+    """
+    import os
+    from resources.lib.cache import ResponseCache
+
+    return ResponseCache(os.path.join(get_profile(), 'cache.db'),
+                         max_size=get_settings().getInt('cachesize') * 1024 * 1024)
+
+
+# Seconds a cached response is served before it is revalidated with the server.
+CACHE_TTL = {
+    'movies': 300,
+    'series': 300,
+    'series-item': 3600,
+    'episodes': 900,
+    'search': 300,
+    # Redirect targets may be signed URLs that expire, keep them briefly.
+    'stream': 900,
+}
+
+# Seconds a directory snapshot is shown right away while the listing is refreshed, per menu.
+# Older snapshots are only shown when the server cannot be reached.
+SNAPSHOT_MAX_AGE = {
+    'movies': 6 * 3600,
+    'series': 6 * 3600,
+}
+
+# Images an All Movies/All Series listing downloads after it is shown. Without a
+# cap a whole library is downloaded before the plugin exits, Kodi fetches the
+# rest itself as the user scrolls.
+ALL_ART_PREWARM = 100
+
+# Titles of a listing whose first megabytes the local proxy keeps, the ones on screen first.
+HEAD_PREFETCH = 10
+
+# Home window property holding the URL of the local proxy, see resources.lib.proxy.
+PROXY_PROPERTY = 'plugin.video.midarr.proxy'
+
+# MIME types of stream URLs by extension, used when the stream was not resolved.
+MIME_TYPES = {
+    '.avi': 'video/x-msvideo',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.m4v': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+    '.mov': 'video/quicktime',
+    '.mp4': 'video/mp4',
+    '.mpd': 'application/dash+xml',
+    '.ts': 'video/mp2t',
+    '.webm': 'video/webm',
+}
+
+
+@lru_cache(maxsize=None)
+def get_artwork():
+    """
+    Local artwork cache, or None if it is disabled.
+
+    :rtype: resources.lib.artwork.ArtworkCache or None
+    """
+    if not get_settings().getBool('artworkcache'):
+        return None
+
+    import os
+    from resources.lib.artwork import ArtworkCache
+
+    return ArtworkCache(os.path.join(get_profile(), 'artwork'), get_client(),
+                        max_size=get_settings().getInt('artworksize') * 1024 * 1024,
+                        resize=get_settings().getBool('artworkresize'),
+                        workers=max(1, get_settings().getInt('concurrency')))
+
+
+def get_proxy():
+    """
+    URL of the local artwork proxy if the background service runs it, None otherwise.
+
+    :rtype: str or None
+    """
+    import xbmcgui
+
+    # The service publishes the URL on the home window, see service.SyncService.update_proxy.
+    return xbmcgui.Window(10000).getProperty(PROXY_PROPERTY) or None
+
+
+def get_art_proxy():
+    """
+    URL of the local proxy if artwork should be served through it, None otherwise.
+    """
+    return get_proxy() if get_settings().getBool('artproxy') else None
+
+
+def nfo_art(baseurl, token):
+    """
+    Function building the art URLs written to .nfo files, see resources.lib.nfo.
+    """
+    proxy = get_art_proxy()
+
+    if proxy is not None:
+        from resources.lib.listing import proxy_art_url
+
+        return lambda path, art_type: proxy_art_url(proxy, path, art_type)
+
+    return lambda path, art_type: f"{baseurl}{path}&token={token}"
+
+
+def open_search_index(run=None, readonly=False):
+    """
+    Open the local search index, or return None if it is disabled or unsupported.
+
+    :param run: id of the sync that fills the index, see SearchIndex
+    :param readonly: open for searching, returns None until a sync created the index
+    :rtype: resources.lib.index.SearchIndex or None
+    """
+    if not get_settings().getBool('searchindex'):
+        return None
+
+    import os
+    import sqlite3
+    import xbmc
+    from resources.lib.index import SearchIndex
+
+    path = os.path.join(get_profile(), 'search.db')
+
+    if readonly and not os.path.exists(path):
+        return None
+
+    try:
+        return SearchIndex(path, run=run, readonly=readonly)
+    except sqlite3.OperationalError as e:
+        # SQLite builds without FTS5 fall back to searching on the server.
+        xbmc.log(f"Local search index unavailable: {e}", xbmc.LOGWARNING)
+        return None
 
 
 def get_url(**kwargs):
@@ -37,69 +237,208 @@ def get_url(**kwargs):
 
 
 def get_videos(mediatype, page):
-    request = urllib.request.Request(
-        f"{SETTINGS.getString('baseurl')}/api/{mediatype}?token={SETTINGS.getString('apitoken')}&page={page}", headers={
-            "Content-Type": "application/json"
-        })
+    response_data = get_cache().get_json(get_client(), f"/api/{mediatype}", {'page': page}, ttl=CACHE_TTL[mediatype])
+    videos = response_data.get("items", [])
+
+    return videos
+
+def get_videos_2(mediatype, page):
+    # Make the API request with page number
+    response_data = get_client().get_json(f"/api/{mediatype}", {'page': page})
+
+    # Extract items and total count from the response
+    videos = response_data.get("items", [])
+    total = response_data.get("total", len(videos))  # Default to the count of items if 'total' is missing
+
+    return videos, total  # Return both videos and total
 
-    with urllib.request.urlopen(request) as response:
-        data = response.read()
-        response_data = json.loads(data.decode("utf-8"))
-        videos = response_data.get("items", [])
 
+def get_all_videos(mediatype):
+    """
+    Fetch every page of a listing and return all items in server order.
+
+    The page count is derived from the 'total' of the first page, the
+    remaining pages are fetched concurrently.
+
+    :param mediatype: movies or series
+    :rtype: list
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    page_size = get_settings().getInt('pagesize')
+
+    def fetch(page):
+        return get_cache().get_json(get_client(), f"/api/{mediatype}", {'page': page, 'per_page': page_size},
+                                    ttl=CACHE_TTL[mediatype])
+
+    response_data = fetch(1)
+    videos = response_data.get("items", [])
+
+    if not videos:
         return videos
 
-def get_videos_2(mediatype, page):
-    # Construct the API request URL with token and page number
-    request = urllib.request.Request(
-        f"{SETTINGS.getString('baseurl')}/api/{mediatype}?token={SETTINGS.getString('apitoken')}&page={page}",
-        headers={"Content-Type": "application/json"}
-    )
-    
-    # Make the API request
-    with urllib.request.urlopen(request) as response:
-        data = response.read()
-        response_data = json.loads(data.decode("utf-8"))
-        
-        # Extract items and total count from the response
-        videos = response_data.get("items", [])
-        total = response_data.get("total", len(videos))  # Default to the count of items if 'total' is missing
-        
-        return videos, total  # Return both videos and total
+    # Use the size of the page we actually got, the server may not honour per_page.
+    total = response_data.get("total", len(videos))
+    pages = -(-total // len(videos))
+
+    # executor.map returns the pages in order, so the merged listing keeps the server order.
+    with ThreadPoolExecutor(max_workers=max(1, get_settings().getInt('concurrency'))) as executor:
+        for response_data in executor.map(fetch, range(2, pages + 1)):
+            videos.extend(response_data.get("items", []))
+
+    return videos
+
+
+def background():
+    """
+    Context for the work a listing does once it is shown. The user is not waiting
+    for it, so its requests go out as background traffic and do not throttle the
+    library sync, see resources.lib.scheduler.
+    """
+    from resources.lib.scheduler import BACKGROUND, priority
+
+    return priority(BACKGROUND)
+
+
+def prefetch_videos(mediatype, page):
+    """
+    Warm the response cache with a listing page the user is likely to open next.
+
+    :param mediatype: movies or series
+    :param page: page number to fetch
+    """
+    import xbmc
+
+    try:
+        get_cache().prefetch(get_client(), f"/api/{mediatype}", {'page': page}, ttl=CACHE_TTL[mediatype])
+    except Exception as e:
+        xbmc.log(f"Failed to prefetch {mediatype} page {page}: {e}", xbmc.LOGWARNING)
 
 
 def get_item(itemid):
-    request = urllib.request.Request(
-        f"{SETTINGS.getString('baseurl')}/api/series/{itemid}?token={SETTINGS.getString('apitoken')}", headers={
-            "Content-Type": "application/json"
-        })
+    return get_cache().get_json(get_client(), f"/api/series/{itemid}", ttl=CACHE_TTL['series-item'])
+
+
+def episodes_request(itemid, season):
+    """
+    API path and query for the episodes of a season.
+    """
+    return f"/api/series/{itemid}", {'season': season, 'has_file': 'true'}
+
+
+def get_episodes(itemid, season, cached=True):
+    path, params = episodes_request(itemid, season)
+
+    # The library sync always wants the current state, browsing can use the cache.
+    if not cached:
+        return get_client().get_json(path, params)
+
+    return get_cache().get_json(get_client(), path, params, ttl=CACHE_TTL['episodes'])
+
+
+def prefetch_seasons(itemid, season_count):
+    """
+    Warm the response cache with the episodes of every season of a series.
+
+    :param itemid: series id
+    :param season_count: number of seasons
+    """
+    import xbmc
+    from concurrent.futures import ThreadPoolExecutor
+    from resources.lib.scheduler import inherit_priority
+
+    def fetch(season):
+        path, params = episodes_request(itemid, season)
+        get_cache().prefetch(get_client(), path, params, ttl=CACHE_TTL['episodes'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, get_settings().getInt('concurrency'))) as executor:
+            list(executor.map(inherit_priority(fetch), range(1, season_count + 1)))
+    except Exception as e:
+        xbmc.log(f"Failed to prefetch seasons of series {itemid}: {e}", xbmc.LOGWARNING)
+
+
+def snapshot_key(action, page):
+    """
+    Cache key of a directory snapshot.
+    """
+    import hashlib
+    from resources.lib.cache import make_key
+
+    settings = get_settings()
+    # Snapshots hold play and art URLs, which change with the token and the proxy.
+    urls = hashlib.sha1(f"{settings.getString('apitoken')}\n{get_art_proxy()}".encode('utf-8')).hexdigest()[:16]
+
+    return f'SNAPSHOT {urls} ' + make_key(settings.getString('baseurl'), f'/{action}', {'page': page})
 
-    with urllib.request.urlopen(request) as response:
-        data = response.read()
-        response_data = json.loads(data.decode("utf-8"))
 
-        return response_data
+def fetch_listing(listing, key, fetch):
+    """
+    Fetch the data of a listing, showing its snapshot first if there is a recent one.
+
+    A shown snapshot already ended the directory, so the caller only builds the
+    listing to save it as the next snapshot, see save_snapshot.
+
+    :param listing: builder of the listing
+    :type listing: resources.lib.listing.ListingBuilder
+    :param key: see snapshot_key
+    :param fetch: function returning the data of the listing
+    :return: the data, or None if the server could not be reached and the snapshot
+        was shown instead; and whether the snapshot was shown
+    :rtype: tuple
+    """
+    import xbmc
+    import xbmcplugin
+
+    tracer = get_tracer()
+    entry = get_cache().get(key) if get_settings().getBool('snapshots') else None
+    shown = entry is not None and entry.fresh
+
+    if shown:
+        with tracer.span('submit', source='snapshot'):
+            listing.submit_snapshot(entry.data)
+        with tracer.span('end'):
+            xbmcplugin.endOfDirectory(HANDLE)
+
+    try:
+        with tracer.span('fetch'):
+            if shown:
+                # The snapshot is shown, the fresh data is only saved for the next time.
+                with background():
+                    return fetch(), shown
+
+            return fetch(), shown
+    except Exception as e:
+        if entry is None:
+            raise
 
+        xbmc.log(f"Failed to refresh the listing, the last snapshot is shown: {e}", xbmc.LOGWARNING)
 
-def get_episodes(itemid, season):
-    request = urllib.request.Request(
-        f"{SETTINGS.getString('baseurl')}/api/series/{itemid}?season={season}&has_file=true&token={SETTINGS.getString('apitoken')}",
-        headers={
-            "Content-Type": "application/json"
-        })
+        if not shown:
+            listing.submit_snapshot(entry.data)
+            xbmcplugin.endOfDirectory(HANDLE)
+
+        return None, True
 
-    with urllib.request.urlopen(request) as response:
-        data = response.read()
-        response_data = json.loads(data.decode("utf-8"))
 
-        return response_data
+def save_snapshot(key, listing, menu):
+    """
+    Keep the listing as shown for the next invocation, see fetch_listing.
+    """
+    if get_settings().getBool('snapshots'):
+        get_cache().put(key, listing.snapshot, ttl=SNAPSHOT_MAX_AGE[menu])
 
 
 def list_seasons(itemid):
+    import xbmcgui
+    import xbmcplugin
+
     xbmcplugin.setContent(HANDLE, 'files')
 
     # Get the list of videos in the category.
-    videos = get_item(itemid)
+    tracer = get_tracer()
+    with tracer.span('fetch'):
+        videos = get_item(itemid)
     # Iterate through videos.
     for video in range(videos['seasonCount']):
         # Create a list item with a text label
@@ -123,10 +462,18 @@ def list_seasons(itemid):
     xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
 
     # Finish creating a virtual folder.
-    xbmcplugin.endOfDirectory(HANDLE)
+    with tracer.span('end'):
+        xbmcplugin.endOfDirectory(HANDLE)
+
+    # The seasons are shown, fetch their episodes while the user picks one.
+    with tracer.span('prefetch'), background():
+        prefetch_seasons(videos['id'], videos['seasonCount'])
 
 
 def list_libraries():
+    import xbmcgui
+    import xbmcplugin
+
     list_item = xbmcgui.ListItem()
 
     # Set images for the list item.
@@ -157,133 +504,308 @@ def list_libraries():
                                 listitem=xbmcgui.ListItem(label="TV Series"),
                                 isFolder=True)
 
+    xbmcplugin.addDirectoryItem(handle=HANDLE, url=get_url(action='all-movies'),
+                                listitem=xbmcgui.ListItem(label="All Movies"),
+                                isFolder=True)
+
+    xbmcplugin.addDirectoryItem(handle=HANDLE, url=get_url(action='all-series'),
+                                listitem=xbmcgui.ListItem(label="All Series"),
+                                isFolder=True)
+
     # Finish creating a virtual folder.
     xbmcplugin.endOfDirectory(HANDLE)
 
 
 def list_series(page):
+    import xbmcgui
+    import xbmcplugin
+    from resources.lib.listing import ListingBuilder
+
     # Set plugin content. It allows Kodi to select appropriate views
     # for this type of content.
     xbmcplugin.setContent(HANDLE, 'tvshows')
-    # Get the list of videos in the category.
-    videos = get_videos('series', page)
-    # Iterate through videos.
-    for video in videos:
-        # Create a list item with a text label
-        list_item = xbmcgui.ListItem(label=video['title'])
-        # Set graphics (thumbnail, fanart, banner, poster, landscape etc.) for the list item.
-        # Here we use only poster for simplicity's sake.
-        # In a real-life plugin you may need to set multiple image types.
-        list_item.setArt({
-            'poster': f"{SETTINGS.getString('baseurl')}{video['poster']}&token={SETTINGS.getString('apitoken')}",
-            'fanart': f"{SETTINGS.getString('baseurl')}{video['background']}&token={SETTINGS.getString('apitoken')}",
-        })
-        # Set additional info for the list item via InfoTag.
-        # 'mediatype' is needed for skin to display info for this ListItem correctly.
-        info_tag = list_item.getVideoInfoTag()
-        info_tag.setMediaType('series')
-        info_tag.setTitle(video['title'])
-        info_tag.setPlot(video['overview'])
-        info_tag.setYear(video['year'])
+    tracer = get_tracer()
+    listing = ListingBuilder(HANDLE, get_url, get_settings(), get_artwork(), get_art_proxy())
+    # Get the list of videos in the category, a recent snapshot is shown meanwhile.
+    key = snapshot_key('page-series', page)
+    videos, shown = fetch_listing(listing, key, lambda: get_videos('series', page))
 
-        xbmcplugin.addDirectoryItem(handle=HANDLE, url=get_url(action='series-item', itemid=video['id']),
-                                    listitem=list_item, isFolder=True)
+    if videos is None:
+        return
+
+    # Iterate through videos.
+    with tracer.span('build', items=len(videos)):
+        for video in videos:
+            list_item = listing.create_item(video, 'series', {'poster': 'poster', 'fanart': 'background'})
+            listing.add_folder(get_url(action='series-item', itemid=video['id']), list_item)
 
     if videos:
         url = get_url(action=f"page-series", page=page + 1)
-        xbmcplugin.addDirectoryItem(handle=HANDLE, url=url, listitem=xbmcgui.ListItem(label="Next Page..."),
-                                    isFolder=True)
+        listing.add_folder(url, xbmcgui.ListItem(label="Next Page...", offscreen=True))
 
-    # Finish creating a virtual folder.
-    xbmcplugin.endOfDirectory(HANDLE)
+    if not shown:
+        # Add the whole page to the Kodi virtual folder listing at once.
+        with tracer.span('submit'):
+            listing.submit()
+
+        # Finish creating a virtual folder.
+        with tracer.span('end'):
+            xbmcplugin.endOfDirectory(HANDLE)
+
+    save_snapshot(key, listing, 'series')
+
+    # The folder is already shown, use the remaining time to fetch the next page.
+    if videos:
+        with tracer.span('prefetch'), background():
+            prefetch_videos('series', page + 1)
+
+    # Cache the images that were fetched from the server for the next visit.
+    with tracer.span('art'), background():
+        listing.download_missing_art()
 
 
 def list_episodes(itemid, season):
+    import xbmcplugin
+    from resources.lib.listing import ListingBuilder
+
     xbmcplugin.setContent(HANDLE, 'episodes')
     # Get the list of videos in the category.
-    videos = get_episodes(itemid, season)
+    tracer = get_tracer()
+    with tracer.span('fetch'):
+        videos = get_episodes(itemid, season)
+    listing = ListingBuilder(HANDLE, get_url, get_settings(), get_artwork(), get_art_proxy())
     # Iterate through videos.
-    for video in videos:
-        # Create a list item with a text label
-        list_item = xbmcgui.ListItem(label=video['title'])
-        # Set graphics (thumbnail, fanart, banner, poster, landscape etc.) for the list item.
-        # Here we use only poster for simplicity's sake.
-        # In a real-life plugin you may need to set multiple image types.
-        list_item.setArt({
-            'thumb': f"{SETTINGS.getString('baseurl')}{video['screenshot']}&token={SETTINGS.getString('apitoken')}",
-        })
-        # Set additional info for the list item via InfoTag.
-        # 'mediatype' is needed for skin to display info for this ListItem correctly.
-        info_tag = list_item.getVideoInfoTag()
-        info_tag.setMediaType('series')
-        info_tag.setTitle(video['title'])
-        info_tag.setPlot(video['overview'])
-
-        # Set 'IsPlayable' property to 'true'.
-        # This is mandatory for playable items!
-        list_item.setProperty('IsPlayable', 'true')
-        # Create a URL for a plugin recursive call.
-        url = get_url(action='play',
-                      video=f"{SETTINGS.getString('baseurl')}{video['stream']}&token={SETTINGS.getString('apitoken')}")
-        # Add the list item to a virtual Kodi folder.
-        # is_folder = False means that this item won't open any sub-list.
-        is_folder = False
-        # Add our item to the Kodi virtual folder listing.
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, is_folder)
+    with tracer.span('build', items=len(videos)):
+        for video in videos:
+            listing.add_playable(video, 'series', {'thumb': 'screenshot'}, year=False)
+
+    # Add the whole page to the Kodi virtual folder listing at once.
+    with tracer.span('submit'):
+        listing.submit()
     # Add sort methods for the virtual folder items
     xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_NONE)
 
     # Finish creating a virtual folder.
-    xbmcplugin.endOfDirectory(HANDLE)
+    with tracer.span('end'):
+        xbmcplugin.endOfDirectory(HANDLE)
+
+    # Resolve the streams while the user picks an episode.
+    with tracer.span('streams'), background():
+        prefetch_streams(listing.streams)
+
+    # Cache the images that were fetched from the server for the next visit.
+    with tracer.span('art'), background():
+        listing.download_missing_art()
 
 
 def list_videos(mediatype, page):
+    import xbmcgui
+    import xbmcplugin
+    from resources.lib.listing import ListingBuilder
+
     # Set plugin content. It allows Kodi to select appropriate views
     # for this type of content.
     xbmcplugin.setContent(HANDLE, mediatype)
-    # Get the list of videos in the category.
-    videos = get_videos(mediatype, page)
-    # Iterate through videos.
-    for video in videos:
-        # Create a list item with a text label
-        list_item = xbmcgui.ListItem(label=video['title'])
-        # Set graphics (thumbnail, fanart, banner, poster, landscape etc.) for the list item.
-        # Here we use only poster for simplicity's sake.
-        # In a real-life plugin you may need to set multiple image types.
-        list_item.setArt({
-            'poster': f"{SETTINGS.getString('baseurl')}{video['poster']}&token={SETTINGS.getString('apitoken')}",
-            'fanart': f"{SETTINGS.getString('baseurl')}{video['background']}&token={SETTINGS.getString('apitoken')}",
-        })
-        # Set additional info for the list item via InfoTag.
-        # 'mediatype' is needed for skin to display info for this ListItem correctly.
-        info_tag = list_item.getVideoInfoTag()
-        info_tag.setMediaType(mediatype)
-        info_tag.setTitle(video['title'])
-        info_tag.setPlot(video['overview'])
-        info_tag.setYear(video['year'])
-
-        # Set 'IsPlayable' property to 'true'.
-        # This is mandatory for playable items!
-        list_item.setProperty('IsPlayable', 'true')
-        # Create a URL for a plugin recursive call.
-        url = get_url(action='play',
-                      video=f"{SETTINGS.getString('baseurl')}{video['stream']}&token={SETTINGS.getString('apitoken')}")
-        # Add the list item to a virtual Kodi folder.
-        # is_folder = False means that this item won't open any sub-list.
-        is_folder = False
-        # Add our item to the Kodi virtual folder listing.
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, is_folder)
     # Add sort methods for the virtual folder items
     xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_LABEL_IGNORE_THE)
     xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
+    tracer = get_tracer()
+    listing = ListingBuilder(HANDLE, get_url, get_settings(), get_artwork(), get_art_proxy())
+    # Get the list of videos in the category, a recent snapshot is shown meanwhile.
+    key = snapshot_key(f'page-{mediatype}', page)
+    videos, shown = fetch_listing(listing, key, lambda: get_videos(mediatype, page))
+
+    if videos is None:
+        return
+
+    # Iterate through videos.
+    with tracer.span('build', items=len(videos)):
+        for video in videos:
+            listing.add_playable(video, mediatype, {'poster': 'poster', 'fanart': 'background'})
 
     if videos:
         url = get_url(action=f"page-{mediatype}", page=page + 1)
-        xbmcplugin.addDirectoryItem(handle=HANDLE, url=url, listitem=xbmcgui.ListItem(label="Next Page..."),
-                                    isFolder=True)
+        listing.add_folder(url, xbmcgui.ListItem(label="Next Page...", offscreen=True))
+
+    if not shown:
+        # Add the whole page to the Kodi virtual folder listing at once.
+        with tracer.span('submit'):
+            listing.submit()
+
+        # Finish creating a virtual folder.
+        with tracer.span('end'):
+            xbmcplugin.endOfDirectory(HANDLE)
+
+    save_snapshot(key, listing, mediatype)
+
+    # The folder is already shown, use the remaining time to fetch the next page.
+    if videos:
+        with tracer.span('prefetch'), background():
+            prefetch_videos(mediatype, page + 1)
+
+    # Resolve the streams while the user picks a movie.
+    with tracer.span('streams'), background():
+        prefetch_streams(listing.streams)
+
+    # Cache the images that were fetched from the server for the next visit.
+    with tracer.span('art'), background():
+        listing.download_missing_art()
+
+
+def list_all(mediatype):
+    """
+    List a whole library in one folder, so Kodi's sort methods apply to all of it.
+
+    :param mediatype: movies or series
+    """
+    import xbmcplugin
+    from resources.lib.listing import ListingBuilder
+
+    xbmcplugin.setContent(HANDLE, 'tvshows' if mediatype == 'series' else mediatype)
+    # Get every page of the category.
+    tracer = get_tracer()
+    with tracer.span('fetch'):
+        videos = get_all_videos(mediatype)
+    listing = ListingBuilder(HANDLE, get_url, get_settings(), get_artwork(), get_art_proxy())
+    # Iterate through videos.
+    with tracer.span('build', items=len(videos)):
+        for video in videos:
+            if mediatype == 'series':
+                list_item = listing.create_item(video, 'series', {'poster': 'poster', 'fanart': 'background'})
+                listing.add_folder(get_url(action='series-item', itemid=video['id']), list_item)
+            else:
+                listing.add_playable(video, mediatype, {'poster': 'poster', 'fanart': 'background'})
+
+    # Add the whole library to the Kodi virtual folder listing at once.
+    with tracer.span('submit'):
+        listing.submit()
+    # Add sort methods for the virtual folder items
+    xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_LABEL_IGNORE_THE)
+    xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
 
     # Finish creating a virtual folder.
-    xbmcplugin.endOfDirectory(HANDLE)
+    with tracer.span('end'):
+        xbmcplugin.endOfDirectory(HANDLE)
+
+    # Cache the images at the top of the listing for the next visit.
+    with tracer.span('art'), background():
+        listing.download_missing_art(ALL_ART_PREWARM)
+
+
+def stream_key(url):
+    """
+    Cache key of a resolved stream, the API token is left out.
+    """
+    from urllib.parse import urlsplit
+    from resources.lib.cache import make_key
+
+    parts = urlsplit(url)
+    params = {name: value for name, value in parse_qsl(parts.query) if name != 'token'}
+
+    return 'HEAD ' + make_key(f'{parts.scheme}://{parts.netloc}', parts.path, params)
+
+
+def resolve_stream(url):
+    """
+    Final URL, MIME type and size of a stream, resolved once and then served from the cache.
+
+    :param url: stream URL
+    :return: see Client.resolve, url is None if the stream was not redirected;
+        None if the server could not be asked
+    :rtype: dict or None
+    """
+    import xbmc
+
+    key = stream_key(url)
+    entry = get_cache().get(key)
+
+    if entry is not None and entry.fresh:
+        return entry.data
+
+    try:
+        stream = get_client().resolve(url)
+    except Exception as e:
+        xbmc.log(f"Failed to resolve stream: {e}", xbmc.LOGWARNING)
+        return None
+
+    # Without a redirect the URL carries the token, the caller already has it.
+    if stream['url'] == url:
+        stream = dict(stream, url=None)
+
+    get_cache().put(key, stream, ttl=CACHE_TTL['stream'])
+
+    return stream
+
+
+def redirect_target(url):
+    """
+    Where a stream URL redirects to according to the resolve cache, None if unknown.
+    """
+    entry = get_cache().get(stream_key(url))
+
+    if entry is None or not entry.fresh:
+        return None
+
+    return entry.data.get('url')
+
+
+def get_stream_proxy():
+    """
+    URL of the local proxy if streams should be played through it, None otherwise.
+    """
+    return get_proxy() if get_settings().getBool('streamproxy') else None
+
+
+def prefetch_head(proxy, url):
+    """
+    Have the local proxy keep the first megabytes of a stream, see resources.lib.readahead.
+    """
+    import xbmc
+    from urllib.request import urlopen
+
+    try:
+        urlopen(f"{proxy}/prefetch?{urlencode({'url': url})}", timeout=60).close()
+    except Exception as e:
+        xbmc.log(f"Failed to prefetch the start of a stream: {e}", xbmc.LOGWARNING)
+
+
+def prefetch_streams(urls):
+    """
+    Prepare the streams of a listing while the user picks one: resolve them, see
+    resolve_stream, and have the local proxy keep the start of the first few.
+    """
+    resolve = get_settings().getBool('resolvestreams')
+    proxy = get_stream_proxy()
+
+    if not urls or not (resolve or proxy):
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from resources.lib.scheduler import inherit_priority
+
+    def prefetch(index, url):
+        # The proxy follows the redirect found here, see redirect_target.
+        if resolve:
+            resolve_stream(url)
+
+        if proxy is not None and index < HEAD_PREFETCH:
+            prefetch_head(proxy, url)
+
+    with ThreadPoolExecutor(max_workers=max(1, get_settings().getInt('concurrency'))) as executor:
+        list(executor.map(inherit_priority(prefetch), range(len(urls)), urls))
+
+
+def guess_mimetype(url):
+    """
+    MIME type from the extension of a URL's path, None if there is none.
+    """
+    path = url.split('?', 1)[0].lower()
+
+    for extension, mimetype in MIME_TYPES.items():
+        if path.endswith(extension):
+            return mimetype
+
+    return None
 
 
 def play_video(path):
@@ -293,201 +815,540 @@ def play_video(path):
     :param path: Fully-qualified video URL
     :type path: str
     """
+    import xbmcgui
+    import xbmcplugin
+
+    mimetype = guess_mimetype(path)
+    # The local proxy only plays server URLs and looks up their redirects itself.
+    proxied = path
+
+    # Skip Kodi's redirect and MIME type lookups if the stream is known already.
+    if get_settings().getBool('resolvestreams'):
+        stream = resolve_stream(path)
+
+        if stream is not None:
+            path = stream['url'] or path
+            mimetype = stream['mimetype'] or guess_mimetype(path)
+
     # Create a playable item with a path to play.
     # offscreen=True means that the list item is not meant for displaying,
     # only to pass info to the Kodi player
     play_item = xbmcgui.ListItem(offscreen=True)
+    # The local proxy reads ahead and starts from the cached head of the stream.
+    proxy = get_stream_proxy()
+    if proxy is not None:
+        path = f"{proxy}/stream?{urlencode({'url': proxied})}"
     play_item.setPath(path)
+    # Midarr streams are always video files, so Kodi does not need to probe the server with
+    # its own HEAD request before it starts the player, which opens the stream anyway.
+    play_item.setContentLookup(False)
+    if mimetype:
+        play_item.setMimeType(mimetype)
     # Pass the item to the Kodi player.
     xbmcplugin.setResolvedUrl(HANDLE, True, listitem=play_item)
 
 
 def search():
+    import xbmcgui
+    import xbmcplugin
+    from resources.lib.listing import ListingBuilder
+
     dialog = xbmcgui.Dialog()
     user_input = dialog.input("Search", type=xbmcgui.INPUT_ALPHANUM)
 
     if user_input:
-        request = urllib.request.Request(
-            f"{SETTINGS.getString('baseurl')}/api/search?query={user_input}&token={SETTINGS.getString('apitoken')}",
-            headers={
-                "Content-Type": "application/json"
-            })
+        tracer = get_tracer()
+
+        with tracer.span('fetch') as span:
+            # Answer from the local index when the library sync keeps it current.
+            videos = None
+            index = open_search_index(readonly=True)
 
-        with urllib.request.urlopen(request) as response:
-            data = response.read()
-            response_data = json.loads(data.decode("utf-8"))
-            videos = response_data.get("items", [])
+            if index is not None:
+                if index.fresh():
+                    videos = index.search(user_input)
+                    span.set(source='index')
+                index.close()
 
-            xbmcplugin.setContent(HANDLE, 'movies')
+            if videos is None:
+                response_data = get_cache().get_json(get_client(), "/api/search", {'query': user_input}, ttl=CACHE_TTL['search'])
+                videos = response_data.get("items", [])
+                span.set(source='server')
 
-            # Iterate through videos.
+        xbmcplugin.setContent(HANDLE, 'movies')
+
+        listing = ListingBuilder(HANDLE, get_url, get_settings(), get_artwork(), get_art_proxy())
+        # Iterate through videos.
+        with tracer.span('build', items=len(videos)):
             for video in videos:
-                # Create a list item with a text label
-                list_item = xbmcgui.ListItem(label=video['title'])
-                # Set graphics (thumbnail, fanart, banner, poster, landscape etc.) for the list item.
-                # Here we use only poster for simplicity's sake.
-                # In a real-life plugin you may need to set multiple image types.
-                list_item.setArt({
-                    'poster': f"{SETTINGS.getString('baseurl')}{video['poster']}&token={SETTINGS.getString('apitoken')}",
-                    'fanart': f"{SETTINGS.getString('baseurl')}{video['background']}&token={SETTINGS.getString('apitoken')}",
-                })
-                # Set additional info for the list item via InfoTag.
-                # 'mediatype' is needed for skin to display info for this ListItem correctly.
-                info_tag = list_item.getVideoInfoTag()
-                info_tag.setMediaType('movie')
-                info_tag.setTitle(video['title'])
-                info_tag.setPlot(video['overview'])
-                info_tag.setYear(video['year'])
-                info_tag.setGenres(['Movies'])
-                # Set 'IsPlayable' property to 'true'.
-                # This is mandatory for playable items!
-                list_item.setProperty('IsPlayable', 'true')
-                # Create a URL for a plugin recursive call.
-                url = get_url(action='play',
-                              video=f"{SETTINGS.getString('baseurl')}{video['stream']}&token={SETTINGS.getString('apitoken')}")
-                # Add the list item to a virtual Kodi folder.
-                # is_folder = False means that this item won't open any sub-list.
-                is_folder = False
-                # Add our item to the Kodi virtual folder listing.
-                xbmcplugin.addDirectoryItem(HANDLE, url, list_item, is_folder)
-            # Add sort methods for the virtual folder items
-            xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_LABEL_IGNORE_THE)
-            xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
-
-            # Finish creating a virtual folder.
+                if video.get('mediatype') == 'series':
+                    list_item = listing.create_item(video, 'series', {'poster': 'poster', 'fanart': 'background'})
+                    listing.add_folder(get_url(action='series-item', itemid=video['id']), list_item)
+                else:
+                    listing.add_playable(video, 'movie', {'poster': 'poster', 'fanart': 'background'}, genres=['Movies'])
+
+        # Add the whole page to the Kodi virtual folder listing at once.
+        with tracer.span('submit'):
+            listing.submit()
+        # Add sort methods for the virtual folder items
+        xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_LABEL_IGNORE_THE)
+        xbmcplugin.addSortMethod(HANDLE, xbmcplugin.SORT_METHOD_VIDEO_YEAR)
+
+        # Finish creating a virtual folder.
+        with tracer.span('end'):
             xbmcplugin.endOfDirectory(HANDLE)
 
+        # Cache the images that were fetched from the server for the next visit.
+        with tracer.span('art'), background():
+            listing.download_missing_art()
 
-def fetch_and_process_videos(mediatype):
-    progress_dialog = xbmcgui.DialogProgressBG()
-    progress_dialog.create("Processing Movies", "Progress")
-    
-    try:
-        page = 1
-        total_videos = None  # Initialize total_videos to None until we get it from the API
-        processed_videos = 0  # Counter for processed videos
-        
-        movies_dir = os.path.join(xbmcvfs.translatePath(xbmcaddon.Addon().getAddonInfo('profile')), mediatype)
-        
-        # Clear the directory if it exists, then create it
-        if os.path.exists(movies_dir):
-            shutil.rmtree(movies_dir)
-
-        os.makedirs(movies_dir)
-
-        # Loop through pages of videos
-        while True:
-            videos, total = get_videos_2(mediatype, page)
-            
-            if total_videos is None:
-                total_videos = total  # Set total_videos once on the first page
-
-            if not videos:  # Stop if no items are returned
+
+def indexed(items, index, mediatype):
+    """
+    Pass items through, adding each one to the search index on the way.
+    """
+    for item in items:
+        if index is not None:
+            index.add(mediatype, item)
+
+        yield item
+
+
+def with_artwork(items, artwork):
+    """
+    Pass items through, queueing their poster and fanart for download on the way.
+    """
+    for item in items:
+        if artwork is not None:
+            for art_type, field in (('poster', 'poster'), ('fanart', 'background')):
+                if item.get(field):
+                    artwork.queue(item[field], art_type)
+
+        yield item
+
+
+def prewarm_artwork():
+    """
+    The artwork cache if the library sync should fill it, None otherwise.
+    """
+    if not get_settings().getBool('artworkprewarm'):
+        return None
+
+    return get_artwork()
+
+
+def movie_files(movies_dir, videos, baseurl, token, taken=None):
+    """
+    Turn movies into the .strm files that represent them.
+
+    :param taken: optional function (path, item id) returning True if another movie
+        of the sync already has the path, see LibraryWriter.taken
+    :return: generator of (video, path, content), path is None for movies without a stream
+    """
+    import os
+
+    for video in videos:
+        title = sanitize_filename(video.get("title", "Unknown Title"))
+        stream_url = video.get("stream")
+
+        if not stream_url:
+            yield video, None, None
+            continue
+
+        # Remakes share their title, the later one gets the year and if needed its id, so
+        # the two do not overwrite each other's file on every sync.
+        year = f" ({video['year']})" if video.get("year") else ""
+        names = [title, f"{title}{year}", f"{title}{year} [{video.get('id')}]"] if taken is not None else [title]
+
+        for name in names:
+            path = os.path.join(movies_dir, f"{name}.strm")
+
+            if taken is None or not taken(path, video.get("id")):
                 break
 
-            # Process each video and create .strm files
-            for video in videos:
-                title = sanitize_filename(video.get("title", "Unknown Title"))
-                stream_url = video.get("stream")
-                
-                if stream_url:
-                    strm_file_path = os.path.join(movies_dir, f"{title}.strm")
-    
-                    try:
-                        with open(strm_file_path, 'w') as strm_file:
-                            strm_file.write(f"{SETTINGS.getString('baseurl')}{stream_url}&token={SETTINGS.getString('apitoken')}")      
+        yield video, path, f"{baseurl}{stream_url}&token={token}"
 
-                    except Exception as e:
-                        xbmc.log(f"Failed to create .strm file: {e}", xbmc.LOGERROR)
-                
-                processed_videos += 1  # Increment processed videos
-                
-                # Update progress dialog based on total progress
-                progress_percent = (processed_videos / total_videos) * 100
-                progress_dialog.update(int(progress_percent))
-                            
-            page += 1  # Move to the next page
+
+def fetch_and_process_videos(mediatype, stop=None):
+    """
+    Write a .strm file for every movie and remove the ones that are gone.
+
+    :param mediatype: movies
+    :param stop: optional function returning True when the sync should stop early
+    :return: whether the sync completed
+    :rtype: bool
+    """
+    import os
+    import xbmc
+    import xbmcgui
+    from resources.lib.checkpoint import Checkpoint
+    from resources.lib.library import LibraryWriter
+    from resources.lib.pipeline import PageStream
+
+    progress_dialog = xbmcgui.DialogProgressBG()
+    progress_dialog.create("Processing Movies", "Progress")
+    checkpoint = None
+    library = None
+    search_index = None
+    artwork = None
+    finished = False
+
+    try:
+        # An interrupted sync continues where it stopped, see Checkpoint.
+        checkpoint = Checkpoint(os.path.join(get_profile(), f'checkpoint-{mediatype}.json'),
+                                get_settings().getString('baseurl'))
+        # The last completed page is fetched again, in case items moved between pages meanwhile.
+        first_page = checkpoint.get('page', 1)
+        processed_videos = checkpoint.get('processed', 0)  # Counter for processed videos
+        page, page_start = None, processed_videos
+
+        movies_dir = os.path.join(get_profile(), mediatype)
+
+        # Only files whose content changed are rewritten, see LibraryWriter.
+        library = LibraryWriter(movies_dir, os.path.join(get_profile(), 'manifest.db'), run=checkpoint.run)
+
+        # Pages are fetched on a background thread while the files are written here.
+        videos = PageStream(lambda page: get_videos_2(mediatype, page), first_page=first_page)
+        search_index = open_search_index(run=checkpoint.run)
+        artwork = prewarm_artwork()
+        videos_to_write = with_artwork(indexed(videos, search_index, mediatype), artwork)
+
+        baseurl = get_settings().getString('baseurl')
+        token = get_settings().getString('apitoken')
+        # Metadata for Kodi, so importing the library needs no online scraper.
+        write_nfo = get_settings().getBool('writenfo')
+
+        if write_nfo:
+            from resources.lib.nfo import movie_nfo
+
+            art_url = nfo_art(baseurl, token)
+
+        # Process each video and create .strm files
+        for video, strm_file_path, content in movie_files(movies_dir, videos_to_write, baseurl, token,
+                                                           taken=library.taken):
+            # Leave the library as it is, nothing is removed by an unfinished sync.
+            if stop is not None and stop():
+                videos.close()
+                xbmc.log("Movie sync stopped early", xbmc.LOGINFO)
+                return False
+
+            # A new page means the previous one is completely written.
+            if videos.page != page:
+                if page is not None:
+                    checkpoint.update(page=page, processed=page_start)
+                    if checkpoint.due():
+                        save_checkpoint(checkpoint, library, search_index, depth=0)
+
+                page, page_start = videos.page, processed_videos
+
+            if strm_file_path:
+                try:
+                    library.write(strm_file_path, content, video.get("id"))
+
+                    if write_nfo:
+                        library.write(f"{os.path.splitext(strm_file_path)[0]}.nfo",
+                                      movie_nfo(video, art_url), video.get("id"))
+
+                except Exception as e:
+                    xbmc.log(f"Failed to create .strm file: {e}", xbmc.LOGERROR)
+
+            processed_videos += 1  # Increment processed videos
+
+            # Update progress dialog based on total progress
+            progress_percent = (processed_videos / videos.total) * 100
+            progress_dialog.update(int(progress_percent))
+
+        # Remove movies that are gone from the server
+        library.finish()
+        if search_index is not None:
+            search_index.finish(mediatype)
+        # Movies share one folder, so that is what Kodi scans.
+        update_library(checkpoint, library, depth=0)
+        checkpoint.clear()
+        finished = True
 
         # Completion notification
         xbmcgui.Dialog().notification("Task Completed", "All videos have been processed!", xbmcgui.NOTIFICATION_INFO, 3000)
 
+        return True
+
     except Exception as e:
         xbmc.log(f"Error fetching and processing videos: {e}", xbmc.LOGERROR)
         xbmcgui.Dialog().notification("Error", "Failed to fetch and process videos", xbmcgui.NOTIFICATION_ERROR, 3000)
+
+        return False
     finally:
+        # Commit what was written and record it, the next sync resumes from the checkpoint.
+        if checkpoint is not None and library is not None and not finished:
+            save_checkpoint(checkpoint, library, search_index, depth=0)
+        if library is not None:
+            library.close()
+        if search_index is not None:
+            search_index.close()
+        if artwork is not None:
+            artwork.wait()
         progress_dialog.close()
 
+def changed_directories(checkpoint, library, depth):
+    """
+    Directories a sync wrote files to, including the ones of an interrupted attempt.
+
+    :param depth: see resources.lib.scanner.directories
+    :rtype: set
+    """
+    from resources.lib.scanner import directories
+
+    return set(checkpoint.get('changed', [])) | directories(library.root, library.created + library.updated, depth)
+
+
+def save_checkpoint(checkpoint, library, search_index, depth):
+    """
+    Commit what a running sync wrote so far, then save its checkpoint.
+    """
+    checkpoint.update(changed=sorted(changed_directories(checkpoint, library, depth)))
+    library.commit()
+    if search_index is not None:
+        search_index.commit()
+    checkpoint.save()
+
+
+def update_library(checkpoint, library, depth):
+    """
+    Have Kodi scan only the directories a finished sync changed, see LibraryUpdater.
+    """
+    if not get_settings().getBool('libraryupdate'):
+        return
+
+    import xbmc
+    from resources.lib.scanner import LibraryUpdater, directories
+
+    LibraryUpdater(xbmc.Monitor()).update(library.root, changed_directories(checkpoint, library, depth),
+                                          directories(library.root, library.deleted, depth))
+
+
 def sanitize_filename(name):
+    import re
+
     # Replace invalid filename characters with underscores
     return re.sub(r'[\/:*?"<>|]', '_', name)
 
-def fetch_and_process_series(mediatype):
-    progress_dialog = xbmcgui.DialogProgressBG()
-    progress_dialog.create("Processing Series", "Progress")
-    
-    try:
-        page = 1
-        total_series = None
-        processed_series = 0
-
-        series_dir = os.path.join(xbmcvfs.translatePath(xbmcaddon.Addon().getAddonInfo('profile')), mediatype)
-        
-        # Clear the directory if it exists
-        if os.path.exists(series_dir):
-            shutil.rmtree(series_dir)
-
-        os.makedirs(series_dir, exist_ok=True)
-
-        while True:
-            series_list, total = get_videos_2(mediatype, page)
-            if total_series is None:
-                total_series = total
-            
-            if not series_list:
-                break
+def season_jobs(series_list, pages, start=0, completed=None):
+    """
+    Expand series into (index, page, series, season) jobs, one per season.
 
-            for series in series_list:
-                series_id = series.get("id")
-                series_title = sanitize_filename(series.get("title", "Unknown Title"))
-                season_count = series.get("seasonCount", 1)
+    :param series_list: series to expand
+    :param pages: the PageStream the series come from, tells the page of each series
+    :param start: index of the first series
+    :param completed: optional function (series, season) returning True for seasons to skip
+    """
+    for index, series in enumerate(series_list, start):
+        for season in range(1, series.get("seasonCount", 1) + 1):
+            if completed is None or not completed(series, season):
+                yield index, pages.page, series, season
 
-                series_directory = os.path.join(series_dir, series_title)
-                os.makedirs(series_directory, exist_ok=True)
 
-                for season in range(1, season_count + 1):
-                    season_directory = os.path.join(series_directory, f"Season {str(season).zfill(2)}")
-                    os.makedirs(season_directory, exist_ok=True)
+def episode_files(series_dir, series, season, episodes, baseurl, token, nfo_art=None):
+    """
+    Turn the episodes of a season into the .strm files that represent them.
+
+    :param nfo_art: also produce an .nfo file per episode, and the tvshow.nfo with the first
+        season, with art URLs built by this function, see nfo_art
+    :return: generator of (item id, path, content)
+    """
+    import os
+
+    series_title = sanitize_filename(series.get("title", "Unknown Title"))
+    season_directory = os.path.join(series_dir, series_title, f"Season {str(season).zfill(2)}")
+
+    if nfo_art is not None:
+        from resources.lib.nfo import episode_nfo, tvshow_nfo
+
+        if season == 1:
+            yield series.get("id"), os.path.join(series_dir, series_title, "tvshow.nfo"), tvshow_nfo(series, nfo_art)
+
+    for episode_number, episode in enumerate(episodes, start=1):
+        stream_url = episode.get("stream")
+
+        if stream_url:
+            filename = f"{series_title} - S{str(season).zfill(2)}E{str(episode_number).zfill(2)}"
+            item_id = episode.get("id", f"{series.get('id')}:{season}:{episode_number}")
+
+            yield (item_id,
+                   os.path.join(season_directory, f"{filename}.strm"),
+                   f"{baseurl}{stream_url}&token={token}")
+
+            if nfo_art is not None:
+                yield (item_id,
+                       os.path.join(season_directory, f"{filename}.nfo"),
+                       episode_nfo(episode, series, season, episode_number, nfo_art))
+
+
+def fetch_and_process_series(mediatype, stop=None):
+    """
+    Write a .strm file for every episode and remove the ones that are gone.
+
+    :param mediatype: series
+    :param stop: optional function returning True when the sync should stop early
+    :return: whether the sync completed
+    :rtype: bool
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+    import xbmc
+    import xbmcgui
+    from resources.lib.checkpoint import Checkpoint
+    from resources.lib.library import LibraryWriter
+    from resources.lib.pipeline import PageStream, ordered_map
 
-                    episodes = get_episodes(series_id, season)
+    progress_dialog = xbmcgui.DialogProgressBG()
+    progress_dialog.create("Processing Series", "Progress")
+    checkpoint = None
+    library = None
+    search_index = None
+    artwork = None
+    finished = False
 
-                    for episode_number, episode in enumerate(episodes, start=1):
-                        stream_url = episode.get("stream")
-                        
-                        if stream_url:
-                            filename = f"{series_title} - S{str(season).zfill(2)}E{str(episode_number).zfill(2)}.strm"
-                            file_path = os.path.join(season_directory, filename)
-    
-                            try:
-                                with open(file_path, 'w') as strm_file:
-                                    strm_file.write(f"{SETTINGS.getString('baseurl')}{stream_url}&token={SETTINGS.getString('apitoken')}")      
-                            except Exception as e:
-                                xbmc.log(f"Failed to create .strm file: {e}", xbmc.LOGERROR)
-                        
-                        processed_series += 1
+    try:
+        series_dir = os.path.join(get_profile(), mediatype)
+        baseurl = get_settings().getString('baseurl')
+        token = get_settings().getString('apitoken')
+        concurrency = max(1, get_settings().getInt('concurrency'))
+        # Metadata for Kodi, so importing the library needs no online scraper.
+        art_url = nfo_art(baseurl, token) if get_settings().getBool('writenfo') else None
+
+        # An interrupted sync continues with the page, series and season where it stopped, see Checkpoint.
+        checkpoint = Checkpoint(os.path.join(get_profile(), f'checkpoint-{mediatype}.json'), baseurl)
+        resume_page = checkpoint.get('page')
+        resume_done = set(checkpoint.get('done', []))
+        resume_series, resume_season = checkpoint.get('series'), checkpoint.get('season', 0)
+
+        # Only files whose content changed are rewritten, see LibraryWriter.
+        library = LibraryWriter(series_dir, os.path.join(get_profile(), 'manifest.db'), run=checkpoint.run)
+
+        # Series pages are fetched on a background thread.
+        series_list = PageStream(lambda page: get_videos_2(mediatype, page), first_page=resume_page or 1)
+        search_index = open_search_index(run=checkpoint.run)
+        artwork = prewarm_artwork()
+        series_to_write = with_artwork(indexed(series_list, search_index, mediatype), artwork)
+
+        def completed(series, season):
+            # Seasons of the resumed page the interrupted sync already wrote.
+            if series_list.page != resume_page:
+                return False
+
+            return series.get("id") in resume_done or (series.get("id") == resume_series and season <= resume_season)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # Season fetches run on a bounded pool. ordered_map yields them in order, so files
+            # are written deterministically, and keeps only a small window of seasons in memory.
+            seasons = ordered_map(executor, lambda job: get_episodes(job[2].get("id"), job[3], cached=False),
+                                  season_jobs(series_to_write, series_list, checkpoint.get('offset', 0), completed),
+                                  window=concurrency * 2)
+
+            for (index, page, series, season), episodes in seasons:
+                # Leave the library as it is, nothing is removed by an unfinished sync.
+                if stop is not None and stop():
+                    series_list.close()
+                    xbmc.log("Series sync stopped early", xbmc.LOGINFO)
+                    return False
+
+                for item_id, file_path, content in episode_files(series_dir, series, season, episodes, baseurl, token,
+                                                                 nfo_art=art_url):
+                    try:
+                        library.write(file_path, content, item_id)
+                    except Exception as e:
+                        xbmc.log(f"Failed to create .strm file: {e}", xbmc.LOGERROR)
 
-                        progress_percent = (processed_series / total_series) * 100
-                        progress_dialog.update(int(progress_percent))
+                if artwork is not None:
+                    for episode in episodes:
+                        if episode.get("screenshot"):
+                            artwork.queue(episode["screenshot"], 'thumb')
+
+                # Record the season as written, the done list only covers the current page.
+                if page != checkpoint.get('page'):
+                    checkpoint.update(page=page, offset=index, done=[])
+                if season >= series.get("seasonCount", 1):
+                    checkpoint.get('done').append(series.get("id"))
+                    checkpoint.update(series=None, season=0)
+                else:
+                    checkpoint.update(series=series.get("id"), season=season)
+                if checkpoint.due():
+                    save_checkpoint(checkpoint, library, search_index, depth=1)
+
+                # Progress counts finished series plus the written share of the current one.
+                progress_percent = ((index + season / series.get("seasonCount", 1)) / series_list.total) * 100
+                progress_dialog.update(int(progress_percent))
 
-            page += 1
+        # Remove series, seasons and episodes that are gone from the server
+        library.finish()
+        if search_index is not None:
+            search_index.finish(mediatype)
+        # Kodi scans changed series by their show folder.
+        update_library(checkpoint, library, depth=1)
+        checkpoint.clear()
+        finished = True
 
         xbmcgui.Dialog().notification("Task Completed", "All series have been processed!", xbmcgui.NOTIFICATION_INFO, 3000)
 
+        return True
+
     except Exception as e:
         xbmc.log(f"Error fetching and processing series: {e}", xbmc.LOGERROR)
         xbmcgui.Dialog().notification("Error", "Failed to fetch and process series", xbmcgui.NOTIFICATION_ERROR, 3000)
+
+        return False
     finally:
+        # Commit what was written and record it, the next sync resumes from the checkpoint.
+        if checkpoint is not None and library is not None and not finished:
+            save_checkpoint(checkpoint, library, search_index, depth=1)
+        if library is not None:
+            library.close()
+        if search_index is not None:
+            search_index.close()
+        if artwork is not None:
+            artwork.wait()
         progress_dialog.close()
 
+
+# Library sync job per media type.
+SYNC_JOBS = {
+    'movies': fetch_and_process_videos,
+    'series': fetch_and_process_series,
+}
+
+
+def run_sync(mediatype, stop=None):
+    """
+    Run a library sync job, traced together with its peak memory use.
+
+    :param mediatype: movies or series
+    :param stop: optional function returning True when the sync should stop early
+    :return: whether the sync completed
+    :rtype: bool
+    """
+    tracer = get_tracer()
+
+    try:
+        with tracer.span('sync', memory=True, mediatype=mediatype) as span:
+            completed = SYNC_JOBS[mediatype](mediatype, stop)
+            span.set(completed=completed)
+
+        return completed
+    finally:
+        tracer.flush()
+
+
+def request_sync(mediatype):
+    """
+    Ask the background service to sync a library.
+
+    :param mediatype: movies or series
+    """
+    import xbmc
+
+    xbmc.executebuiltin(f'NotifyAll(plugin.video.midarr,sync_{mediatype})')
+
+
 def router(param_string):
     # Parse a URL-encoded param_string to the dictionary of
     # {<parameter>: <value>} elements
@@ -514,6 +1375,14 @@ def router(param_string):
         # Display the list of videos in a provided category.
         list_series(page=int(params['page']))
 
+    elif params['action'] == 'all-movies':
+        # Display every movie in one folder.
+        list_all('movies')
+
+    elif params['action'] == 'all-series':
+        # Display every series in one folder.
+        list_all('series')
+
     elif params['action'] == 'series-item':
         # Display the list of videos in a provided category.
         list_seasons(itemid=int(params['itemid']))
@@ -530,10 +1399,11 @@ def router(param_string):
         search()
 
     elif params['action'] == 'add_movies':
-        threading.Thread(target=fetch_and_process_videos, args=("movies",)).start()
-    
+        # The sync runs in the long-lived service, this invocation ends right away.
+        request_sync('movies')
+
     elif params['action'] == 'add_series':
-        threading.Thread(target=fetch_and_process_series, args=("series",)).start()
+        request_sync('series')
 
     else:
         # If the provided param_string does not contain a supported action
@@ -543,6 +1413,20 @@ def router(param_string):
 
 
 if __name__ == '__main__':
-    # Call the router function and pass the plugin call parameters to it.
     # We use string slicing to trim the leading '?' from the plugin call param_string
-    router(sys.argv[2][1:])
+    param_string = sys.argv[2][1:]
+
+    if not param_string:
+        # The root listing reads no settings and calls no API, loading the settings
+        # only to find tracing disabled would cost more than the listing itself.
+        router(param_string)
+    else:
+        tracer = get_tracer()
+
+        try:
+            # Only the action is traced, parameters may carry stream URLs with the API token.
+            with tracer.span('router', action=dict(parse_qsl(param_string)).get('action')):
+                # Call the router function and pass the plugin call parameters to it.
+                router(param_string)
+        finally:
+            tracer.flush()
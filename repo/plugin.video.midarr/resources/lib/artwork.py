@@ -0,0 +1,248 @@
+"""
+Local artwork cache.
+
+Posters, fanart and thumbs are downloaded once into the addon profile and
+ListItems point at the local files, so clearing Kodi's texture cache or adding
+another client does not pull full-size images from the Midarr server again.
+Files are keyed by the image path the API returns, which carries neither the
+server address nor the API token. Least recently used files are evicted once
+the cache grows past its disk budget.
+
+Downscaled poster and thumb variants are kept instead of the originals when
+Pillow (script.module.pil) is available and resizing is enabled.
+"""
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from resources.lib.scheduler import inherit_priority
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS artwork (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artwork_accessed ON artwork (accessed);
+'''
+
+# Access times kept in memory before they are written in one transaction.
+ACCESS_BATCH = 100
+# Default disk budget in bytes.
+DEFAULT_MAX_SIZE = 200 * 1024 * 1024
+# Largest edge in pixels of the downscaled variants, by Kodi art type.
+VARIANT_SIZES = {
+    'poster': (500, 750),
+    'thumb': (640, 360),
+}
+
+
+class ArtworkCache:
+    """
+    Disk cache of server artwork.
+
+    :param directory: cache directory, e.g. <profile>/artwork
+    :param client: API client used for downloads
+    :type client: resources.lib.client.Client
+    :param max_size: disk budget in bytes
+    :param resize: keep downscaled poster and thumb variants, needs Pillow
+    :param workers: parallel downloads
+    """
+
+    def __init__(self, directory, client, max_size=DEFAULT_MAX_SIZE, resize=False, workers=4):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.client = client
+        self.max_size = max_size
+        self.resize = resize and Image is not None
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'artwork.db'), timeout=10,
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        # Access times of cache hits, written after the listing is shown instead
+        # of one commit per image while it renders.
+        self._accessed = {}
+        self._executor = None
+        # Limits queued downloads so a library sync cannot queue the whole catalog.
+        self._slots = threading.BoundedSemaphore(workers * 4)
+        self._queued = set()
+
+    def _key(self, path, art_type):
+        variant = art_type if self.resize and art_type in VARIANT_SIZES else 'original'
+
+        return hashlib.sha1(f'{variant}:{path}'.encode('utf-8')).hexdigest()
+
+    def get(self, path, art_type):
+        """
+        Return the local file for an image, or None if it is not cached yet.
+
+        :param path: image path as returned by the API
+        :param art_type: Kodi art type, e.g. poster
+        """
+        key = self._key(path, art_type)
+
+        with self._lock:
+            row = self._db.execute('SELECT file FROM artwork WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            self._accessed[key] = time.time()
+
+            # A long running process, e.g. the local proxy, writes them as it goes.
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._write_accessed()
+
+        file = os.path.join(self.directory, row[0])
+
+        return file if os.path.exists(file) else None
+
+    def queue(self, path, art_type):
+        """
+        Download an image in the background unless it is cached or already queued.
+        """
+        key = self._key(path, art_type)
+
+        with self._lock:
+            if key in self._queued:
+                return
+            if self._db.execute('SELECT 1 FROM artwork WHERE key = ?', (key,)).fetchone():
+                return
+
+            self._queued.add(key)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        self._slots.acquire()
+        self._executor.submit(inherit_priority(self._download), key, path, art_type)
+
+    def fetch(self, path, art_type):
+        """
+        Return the local file for an image, downloading it first if it is not cached.
+
+        :raises resources.lib.client.ApiError: if the server does not have the image
+        """
+        file = self.get(path, art_type)
+
+        if file is None:
+            file = self._store(self._key(path, art_type), path, art_type)
+            self.evict()
+
+        return file
+
+    def _store(self, key, path, art_type):
+        # Concurrent downloads of the same image each use their own temporary file.
+        temporary = os.path.join(self.directory, f'{key}.{threading.get_ident()}.download')
+
+        try:
+            response = self.client.download(path, temporary)
+            extension = mimetypes.guess_extension(
+                response.headers.get('Content-Type', '').split(';')[0].strip()) or '.jpg'
+            file = f'{key[:2]}/{key}{extension}'
+            target = os.path.join(self.directory, file)
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            if self.resize and art_type in VARIANT_SIZES:
+                self._downscale(temporary, target, VARIANT_SIZES[art_type])
+                os.remove(temporary)
+            else:
+                os.replace(temporary, target)
+        except Exception:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO artwork (key, file, size, accessed) VALUES (?, ?, ?, ?)',
+                             (key, file, os.path.getsize(target), time.time()))
+
+        return target
+
+    def _download(self, key, path, art_type):
+        try:
+            self._store(key, path, art_type)
+        except Exception:
+            # A missing image is not worth failing a listing or sync for, the
+            # remote URL keeps being used until a later download succeeds.
+            pass
+        finally:
+            with self._lock:
+                self._queued.discard(key)
+            self._slots.release()
+
+    @staticmethod
+    def _downscale(source, target, size):
+        with Image.open(source) as image:
+            image.thumbnail(size)
+            image.save(target, format=image.format)
+
+    def _write_accessed(self):
+        # Called with the lock held.
+        if not self._accessed:
+            return
+
+        self._db.execute('BEGIN')
+        self._db.executemany('UPDATE artwork SET accessed = ? WHERE key = ?',
+                             [(accessed, key) for key, accessed in self._accessed.items()])
+        self._db.execute('COMMIT')
+        self._accessed = {}
+
+    def wait(self):
+        """
+        Finish all queued downloads, write the access times and enforce the disk budget.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            # The order of eviction depends on them.
+            self._write_accessed()
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM artwork').fetchone()[0]
+
+            if total <= self.max_size:
+                return
+
+            # Drop least recently used files until we are back under 90% of the budget.
+            excess = total - int(self.max_size * 0.9)
+            freed = 0
+            evicted = []
+
+            for key, file, size in self._db.execute('SELECT key, file, size FROM artwork ORDER BY accessed'):
+                evicted.append((key, file))
+                freed += size
+
+                if freed >= excess:
+                    break
+
+            self._db.executemany('DELETE FROM artwork WHERE key = ?', [(key,) for key, _ in evicted])
+
+        for _, file in evicted:
+            try:
+                os.remove(os.path.join(self.directory, file))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.wait()
+
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,232 @@
+"""
+Persistent API response cache.
+
+Responses are kept in a single SQLite file in the addon profile so that they
+survive between plugin invocations. Fresh entries are served without touching
+the network, expired ones are revalidated with ``If-None-Match`` /
+``If-Modified-Since`` and the least recently used entries are evicted once the
+cache grows past its size budget.
+
+Fetches leave an in-flight marker next to the database, so concurrent plugin
+invocations asking for the same response, e.g. several home screen widgets or
+a listing and its prefetch, share one request to the server; see
+resources.lib.singleflight.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+from resources.lib.singleflight import SingleFlight
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+'''
+
+# Default size budget in bytes.
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+# Seconds on top of the client deadline before a fetch's marker is considered
+# abandoned, for storing the response and for a slow filesystem.
+FLIGHT_MARGIN = 10
+
+
+def make_key(baseurl, path, params=None):
+    """
+    Build a cache key from the server, endpoint and query.
+
+    The API token is deliberately not part of the key.
+    """
+    query = urlencode(sorted((params or {}).items()))
+
+    return f'{baseurl}{path}?{query}'
+
+
+class Entry:
+    """
+    A cached response body with its validators.
+    """
+
+    def __init__(self, data, etag, last_modified, expires):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return self.expires > time.time()
+
+
+class ResponseCache:
+    """
+    SQLite backed response cache.
+
+    :param path: database file, e.g. <profile>/cache.db
+    :param max_size: size budget in bytes for the stored bodies
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_size = max_size
+        self._flights = SingleFlight(os.path.join(os.path.dirname(path), 'inflight'))
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def get(self, key):
+        """
+        Look up an entry, fresh or not.
+
+        :rtype: Entry or None
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT data, etag, last_modified, expires FROM responses WHERE key = ?', (key,)).fetchone()
+
+            if row is None:
+                return None
+
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        data, etag, last_modified, expires = row
+
+        return Entry(json.loads(zlib.decompress(data)), etag, last_modified, expires)
+
+    def put(self, key, data, ttl, etag=None, last_modified=None):
+        blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        now = time.time()
+
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses (key, data, size, etag, last_modified, expires, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, blob, len(blob), etag, last_modified, now + ttl, now))
+            self._evict()
+
+    def refresh(self, key, ttl):
+        """
+        Extend the lifetime of an entry that the server confirmed unchanged.
+        """
+        now = time.time()
+
+        with self._lock:
+            self._db.execute('UPDATE responses SET expires = ?, accessed = ? WHERE key = ?', (now + ttl, now, key))
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        # Drop least recently used entries until we are back under 90% of the budget.
+        excess = total - int(self.max_size * 0.9)
+        freed = 0
+        keys = []
+
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            keys.append((key,))
+            freed += size
+
+            if freed >= excess:
+                break
+
+        self._db.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _fetch(self, client, key, entry, path, params, ttl):
+        headers = {}
+
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = client.request(path, params, headers)
+
+        if response.status == 304 and entry is not None:
+            self.refresh(key, ttl)
+
+            return entry.data
+
+        self.put(key, response.data, ttl,
+                 etag=response.headers.get('ETag'),
+                 last_modified=response.headers.get('Last-Modified'))
+
+        return response.data
+
+    def get_json(self, client, path, params=None, ttl=0):
+        """
+        Fetch an API path through the cache.
+
+        Fresh entries are returned as is. Stale entries are revalidated and a 304
+        only extends their lifetime instead of transferring the body again.
+        Concurrent invocations asking for the same response wait for the one
+        that fetches it and use its result, even if ttl is 0.
+
+        :param client: API client used on a miss
+        :type client: resources.lib.client.Client
+        :param path: API path, e.g. /api/movies
+        :param params: query parameters
+        :param ttl: seconds the response may be served without revalidation
+        :return: decoded JSON body
+        """
+        key = make_key(client.baseurl, path, params)
+        entry = self.get(key)
+
+        if entry is not None and entry.fresh:
+            return entry.data
+
+        started = time.time()
+
+        # The owner of the marker may retry until its client's deadline.
+        with self._flights.lead(key, timeout=client.deadline + FLIGHT_MARGIN):
+            entry = self.get(key)
+
+            # Fresh, or stored by the invocation this one waited for.
+            if entry is not None and (entry.fresh or entry.expires - ttl >= started):
+                return entry.data
+
+            return self._fetch(client, key, entry, path, params, ttl)
+
+    def prefetch(self, client, path, params=None, ttl=0):
+        """
+        Warm the cache for a response the user is likely to ask for next.
+
+        Does nothing if the entry is still fresh or another invocation is
+        already fetching it.
+        """
+        key = make_key(client.baseurl, path, params)
+        entry = self.get(key)
+
+        if entry is not None and entry.fresh:
+            return
+
+        if not self._flights.claim(key):
+            return
+
+        try:
+            self._fetch(client, key, entry, path, params, ttl)
+        finally:
+            self._flights.release(key)
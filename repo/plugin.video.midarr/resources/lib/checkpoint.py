@@ -0,0 +1,92 @@
+"""
+Checkpoint journal of an unfinished library sync.
+
+A sync records how far it got (pages, series, seasons) in a small JSON file in
+the addon profile. An interrupted sync is resumed from there by the next run,
+which also takes over the run id, so the files and index entries the first
+attempt wrote count as seen when the finished sync removes stale ones.
+"""
+import json
+import os
+import time
+
+# Seconds after which an unfinished sync is started over instead of resumed.
+MAX_AGE = 24 * 3600
+# Seconds between saves while a sync is running.
+SAVE_INTERVAL = 5
+
+
+class Checkpoint:
+    """
+    Progress of a sync, resumed from the journal if one is left over.
+
+    :param path: journal file, e.g. <profile>/checkpoint-movies.json
+    :param key: identifies the library, e.g. the server URL; a journal
+        written for another key is ignored
+    :param max_age: seconds after which a journal is ignored
+    """
+
+    def __init__(self, path, key, max_age=MAX_AGE):
+        self.path = path
+        self.state = self._load(key, max_age)
+        self.resumed = self.state is not None
+
+        if self.state is None:
+            self.state = {'key': key, 'run': int(time.time() * 1000), 'started': time.time()}
+
+        self._saved = time.monotonic()
+
+    def _load(self, key, max_age):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if state.get('key') != key or time.time() - state.get('started', 0) > max_age:
+            return None
+
+        return state
+
+    @property
+    def run(self):
+        """
+        Run id shared by all attempts of the same sync.
+        """
+        return self.state['run']
+
+    def get(self, name, default=None):
+        return self.state.get(name, default)
+
+    def update(self, **fields):
+        """
+        Record progress in memory, see save.
+        """
+        self.state.update(fields)
+
+    def due(self):
+        """
+        Whether enough time passed since the last save to save again.
+        """
+        return time.monotonic() - self._saved >= SAVE_INTERVAL
+
+    def save(self):
+        """
+        Write the journal. Only call this once the recorded progress is committed.
+        """
+        temporary = f'{self.path}.tmp'
+
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.state, file)
+
+        os.replace(temporary, self.path)
+        self._saved = time.monotonic()
+
+    def clear(self):
+        """
+        Remove the journal after the sync finished.
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,596 @@
+"""
+Pooled HTTP client for the Midarr API.
+
+Kodi starts the plugin once per navigation and a library sync issues hundreds
+of requests back to back, so connections are kept alive and shared per
+``baseurl`` instead of opening a new TCP/TLS connection for every call.
+
+Every request has a deadline. Requests are GETs and therefore idempotent, so
+failed attempts are retried with jittered exponential backoff within that
+deadline, and a slow attempt can optionally be hedged with a second one once it
+takes longer than the p95 latency observed for the server. Latencies are only
+known within a process and hedging needs MIN_HEDGE_SAMPLES of them, so it
+applies to long runs like the library sync, not to a single listing. Each
+attempt waits for a slot from the request scheduler first, see
+resources.lib.scheduler.
+"""
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit
+
+from resources.lib.scheduler import NULL_SCHEDULER, inherit_priority
+from resources.lib.trace import NULL_TRACER
+
+# Seconds to wait for the connection and for each socket read.
+DEFAULT_TIMEOUT = 15
+# Seconds a request may take in total, including retries.
+DEFAULT_DEADLINE = 30
+# Attempts after the first one.
+DEFAULT_RETRIES = 2
+# Base and cap in seconds of the exponential backoff between attempts.
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4
+# Statuses worth another attempt.
+RETRY_STATUSES = (429, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Redirects followed when resolving a stream URL.
+MAX_REDIRECTS = 5
+# Latency samples kept per server, and how many are needed before hedging.
+LATENCY_SAMPLES = 100
+MIN_HEDGE_SAMPLES = 20
+# Share of requests that may be hedged, so hedging cannot double the load on a
+# server that is slow for everyone.
+HEDGE_BUDGET = 0.05
+# Idle connections kept open per server.
+POOL_SIZE = 8
+# Bytes read at a time when downloading files.
+CHUNK_SIZE = 64 * 1024
+
+HEADERS = {
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip',
+    'Connection': 'keep-alive',
+    'User-Agent': 'plugin.video.midarr',
+}
+
+# Errors raised when a kept-alive connection was closed by the server while idle.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, BrokenPipeError)
+# Errors worth another attempt, socket timeouts included.
+RETRY_ERRORS = (OSError, http.client.HTTPException)
+
+
+class ApiError(Exception):
+    """
+    Raised when the Midarr server answers with an unexpected HTTP status.
+    """
+
+    def __init__(self, status, reason, path):
+        super().__init__(f'{status} {reason} for {path}')
+        self.status = status
+        self.reason = reason
+        self.path = path
+
+
+class Response:
+    """
+    A fully consumed API response.
+
+    :param status: HTTP status code
+    :param headers: response headers
+    :param data: decoded JSON body, ``None`` for bodiless responses (e.g. 304)
+    :param reason: HTTP reason phrase
+    :param size: bytes received, only counted while tracing
+    """
+
+    def __init__(self, status, headers, data, reason='', size=None):
+        self.status = status
+        self.headers = headers
+        self.data = data
+        self.reason = reason
+        self.size = size
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to a single Midarr server.
+    """
+
+    def __init__(self, baseurl, timeout=DEFAULT_TIMEOUT, maxsize=POOL_SIZE):
+        parts = urlsplit(baseurl)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.host = parts.hostname
+        self.port = parts.port
+        # Midarr may be served below a path, e.g. https://example.com/midarr
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = []
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._hedgeable = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take an idle connection or open a new one.
+
+        :return: connection and whether it has been used before
+        :rtype: tuple
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(connection)
+                return
+
+        connection.close()
+
+    def discard(self, connection):
+        connection.close()
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def p95(self):
+        """
+        95th percentile of recent request latencies, None until enough were seen.
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+
+            latencies = sorted(self._latencies)
+
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def count_hedgeable(self):
+        with self._lock:
+            self._hedgeable += 1
+
+    def take_hedge(self):
+        """
+        Count a hedged attempt if the budget allows another one.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self._hedges + 1 > self._hedgeable * HEDGE_BUDGET:
+                return False
+
+            self._hedges += 1
+
+            return True
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+# Runs hedged attempts, created on first use and replaced by a larger one when
+# the concurrency setting grows.
+_HEDGE_EXECUTOR = None
+_HEDGE_WORKERS = 0
+
+
+def get_pool(baseurl, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the shared connection pool for a server, creating it on first use.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(baseurl)
+
+        if pool is None:
+            pool = _POOLS[baseurl] = ConnectionPool(baseurl, timeout)
+
+        return pool
+
+
+def _body(response):
+    """
+    The (optionally gzipped) response body as a stream.
+    """
+    if response.getheader('Content-Encoding', '').lower() == 'gzip':
+        return gzip.GzipFile(fileobj=response)
+
+    return response
+
+
+def _read_json(response):
+    """
+    Decode a JSON body straight from the response stream.
+    """
+    data = json.load(_body(response))
+
+    # Drain anything left so the connection can be reused.
+    response.read()
+
+    return data
+
+
+class _CountingResponse:
+    """
+    Response proxy counting the bytes read from the wire, for tracing.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.bytes = 0
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self.bytes += len(data)
+
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def path_template(path, params):
+    """
+    Path with ids replaced and query values left out, e.g. /api/series/{id}?season.
+    """
+    template = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+    names = sorted(name for name, _ in (params.items() if isinstance(params, dict) else params or ()))
+
+    return f"{template}?{'&'.join(names)}" if names else template
+
+
+def _hedge_executor(workers):
+    global _HEDGE_EXECUTOR, _HEDGE_WORKERS
+
+    with _POOLS_LOCK:
+        if _HEDGE_WORKERS < workers:
+            # The old executor is left to finish what was submitted to it.
+            _HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=workers)
+            _HEDGE_WORKERS = workers
+
+        return _HEDGE_EXECUTOR
+
+
+def _backoff(attempt, remaining, retry_after=None):
+    """
+    Seconds to sleep before the next attempt, full jitter, never past the deadline.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+    if retry_after is not None and retry_after.isdigit():
+        delay = max(delay, int(retry_after))
+
+    return min(delay, max(0, remaining))
+
+
+class Client:
+    """
+    Midarr API client bound to a server URL and API token.
+
+    :param baseurl: server URL, e.g. http://midarr.home
+    :param token: API token
+    :param timeout: connect and read timeout in seconds
+    :param deadline: total seconds a request may take, including retries
+    :param retries: attempts after the first one
+    :param hedge: send a second attempt when the first one is slower than p95
+    :param concurrency: requests the caller sends at once, sizes the threads running hedged attempts
+    :param tracer: records a span per attempt
+    :type tracer: resources.lib.trace.Tracer
+    :param scheduler: paces the attempts sent to the server
+    :type scheduler: resources.lib.scheduler.RequestScheduler
+    """
+
+    def __init__(self, baseurl, token, timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE,
+                 retries=DEFAULT_RETRIES, hedge=False, concurrency=4, tracer=NULL_TRACER,
+                 scheduler=NULL_SCHEDULER):
+        self.baseurl = baseurl.rstrip('/')
+        self.token = token
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+        self.concurrency = max(1, concurrency)
+        self.tracer = tracer
+        self.scheduler = scheduler
+        self.pool = get_pool(self.baseurl, timeout)
+
+    def _attempt(self, target, template, headers, read, deadline, sent=None):
+        """
+        Send a single GET and consume the body of a 200 response with ``read``.
+
+        :param sent: event set once the request goes out on a connected socket
+        :type sent: threading.Event
+        :rtype: Response
+        """
+        with self.tracer.span('api', path=template) as span:
+            response = self._send(target, headers, read, deadline, sent)
+            span.set(status=response.status, bytes=response.size)
+
+        return response
+
+    def _send(self, target, headers, read, deadline, sent=None):
+        while True:
+            if deadline - time.monotonic() <= 0:
+                raise TimeoutError(f'Deadline exceeded for {target}')
+
+            with self.scheduler.slot(deadline) as slot:
+                remaining = deadline - time.monotonic()
+                connection, reused = self.pool.acquire()
+                # Never wait on the socket longer than the request has left.
+                connection.timeout = min(self.pool.timeout, max(remaining, 0.1))
+                if connection.sock is not None:
+                    connection.sock.settimeout(connection.timeout)
+
+                try:
+                    if connection.sock is None:
+                        connection.connect()
+
+                    # Latencies and the hedge timer start here, waiting for a slot or a
+                    # connection says nothing about how fast the server answers.
+                    started = time.monotonic()
+                    if sent is not None:
+                        sent.set()
+
+                    connection.request('GET', target, headers=headers)
+                    response = connection.getresponse()
+                except STALE_CONNECTION_ERRORS:
+                    self.pool.discard(connection)
+                    # The server dropped an idle connection, retry once on a fresh one.
+                    if reused:
+                        continue
+                    raise
+                except Exception:
+                    self.pool.discard(connection)
+                    raise
+
+                # Time to first byte, the body size says nothing about the server's load.
+                slot.record(time.monotonic() - started, response.status)
+                body = _CountingResponse(response) if self.tracer.enabled else response
+
+                try:
+                    if response.status == 200:
+                        data = read(body)
+                    else:
+                        response.read()
+                        data = None
+                except Exception:
+                    self.pool.discard(connection)
+                    raise
+
+                if response.will_close:
+                    self.pool.discard(connection)
+                else:
+                    self.pool.release(connection)
+
+                if response.status < 500:
+                    self.pool.record_latency(time.monotonic() - started)
+
+                return Response(response.status, response.headers, data, response.reason,
+                                body.bytes if body is not response else None)
+
+    def _hedged(self, attempt):
+        """
+        Run an attempt and race a second one if it is slower than usual.
+
+        The p95 timer starts once the attempt is sent, and at most HEDGE_BUDGET
+        of the requests get a second attempt.
+        """
+        self.pool.count_hedgeable()
+        delay = self.pool.p95()
+
+        if delay is None:
+            return attempt()
+
+        sent = threading.Event()
+
+        def first():
+            try:
+                return attempt(sent)
+            finally:
+                # Also when it failed before it was sent.
+                sent.set()
+
+        # A first and a second attempt for every request the caller runs at once.
+        executor = _hedge_executor(2 * self.concurrency)
+        pending = {executor.submit(inherit_priority(first))}
+        sent.wait()
+        done, pending = wait(pending, timeout=delay)
+
+        if not done and self.pool.take_hedge():
+            pending.add(executor.submit(inherit_priority(attempt)))
+
+        error = None
+
+        while pending or done:
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        raise error
+
+    def _get(self, path, params, headers, read, hedge=False):
+        """
+        Send a GET request, retrying failed attempts until the deadline.
+
+        :return: the consumed response, ``data`` is whatever ``read`` returned
+        :rtype: Response
+        :raises ApiError: on any status other than 200 or 304
+        """
+        query = dict(params or {})
+        query['token'] = self.token
+        target = f'{self.pool.prefix}{path}?{urlencode(query)}'
+        template = path_template(path, params)
+
+        request_headers = dict(HEADERS)
+        request_headers.update(headers or {})
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+
+        def send(sent=None):
+            return self._attempt(target, template, request_headers, read, deadline, sent)
+
+        while True:
+            retry_after = None
+
+            try:
+                response = self._hedged(send) if hedge and self.hedge else send()
+            except RETRY_ERRORS:
+                if attempt >= self.retries or time.monotonic() >= deadline:
+                    raise
+            else:
+                if response.status in (200, 304):
+                    return response
+
+                if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                    raise ApiError(response.status, response.reason, path)
+
+                retry_after = response.headers.get('Retry-After')
+
+            time.sleep(_backoff(attempt, deadline - time.monotonic(), retry_after))
+            attempt += 1
+
+    def request(self, path, params=None, headers=None):
+        """
+        Send a GET request for an API path.
+
+        :param path: API path, e.g. /api/movies
+        :param params: query parameters, the API token is added automatically
+        :param headers: extra request headers, e.g. conditional headers
+        :return: the consumed response with the decoded JSON body
+        :rtype: Response
+        :raises ApiError: on any status other than 200 or 304
+        """
+        return self._get(path, params, headers, _read_json, hedge=True)
+
+    def download(self, path, destination):
+        """
+        Download a server path, e.g. an image returned by the API, to a file.
+
+        Downloads are retried but never hedged, two attempts would write the
+        same file.
+
+        :param path: server path, may carry its own query string
+        :param destination: file to write, replaced only once the download completed
+        :return: the consumed response, ``data`` is the number of bytes written
+        :rtype: Response
+        """
+        parts = urlsplit(path)
+
+        def read(response):
+            temporary = f'{destination}.tmp'
+            size = 0
+            body = _body(response)
+
+            with open(temporary, 'wb') as file:
+                for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+                    file.write(chunk)
+                    size += len(chunk)
+
+            response.read()
+            os.replace(temporary, destination)
+
+            return size
+
+        return self._get(parts.path, parse_qsl(parts.query), {'Accept': '*/*'}, read)
+
+    def resolve(self, url, max_redirects=MAX_REDIRECTS):
+        """
+        Follow the redirects of a stream URL with HEAD requests, like Kodi does before playing it.
+
+        Redirects may lead to other servers, each one gets its own connection pool.
+
+        :param url: absolute stream URL
+        :return: 'url' after all redirects, 'mimetype' and 'size' (None when unknown)
+        :rtype: dict
+        :raises ApiError: on an error status or too many redirects
+        """
+        headers = {'Accept': '*/*', 'User-Agent': HEADERS['User-Agent']}
+
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            pool = get_pool(f'{parts.scheme}://{parts.netloc}', self.pool.timeout)
+            target = f"{parts.path or '/'}?{parts.query}" if parts.query else parts.path or '/'
+
+            with self.tracer.span('resolve', path=path_template(parts.path, ())) as span, \
+                    self.scheduler.slot() as slot:
+                started = time.monotonic()
+                response = self._head(pool, target, headers)
+                slot.record(time.monotonic() - started, response.status)
+                span.set(status=response.status)
+
+            location = response.getheader('Location')
+
+            if response.status in REDIRECT_STATUSES and location:
+                url = urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                raise ApiError(response.status, response.reason, parts.path)
+
+            length = response.getheader('Content-Length')
+            content_type = response.getheader('Content-Type')
+
+            return {
+                'url': url,
+                'mimetype': content_type.split(';')[0].strip() if content_type else None,
+                'size': int(length) if length and length.isdigit() else None,
+            }
+
+        raise ApiError(310, 'Too many redirects', urlsplit(url).path)
+
+    def _head(self, pool, target, headers):
+        while True:
+            connection, reused = pool.acquire()
+
+            try:
+                connection.request('HEAD', target, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except STALE_CONNECTION_ERRORS:
+                pool.discard(connection)
+                # The server dropped an idle connection, retry once on a fresh one.
+                if reused:
+                    continue
+                raise
+            except Exception:
+                pool.discard(connection)
+                raise
+
+            if response.will_close:
+                pool.discard(connection)
+            else:
+                pool.release(connection)
+
+            return response
+
+    def get_json(self, path, params=None):
+        """
+        Fetch an API path and return its decoded JSON body.
+        """
+        return self.request(path, params).data
@@ -0,0 +1,152 @@
+"""
+Local full-text search index of the Midarr catalog.
+
+The library sync feeds every movie and series into a SQLite FTS5 index in the
+addon profile, so searches can be answered locally with prefix matching
+instead of waiting on the server.
+"""
+import json
+import re
+import sqlite3
+import time
+from urllib.request import pathname2url
+
+# Bumped whenever SCHEMA changes, databases with an older user_version run it
+# again. Version 1 recreates items_au with its WHEN clause: before it every
+# item was reindexed on every sync, because the upsert names the indexed
+# columns whether or not their values changed.
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    rowid INTEGER PRIMARY KEY,
+    mediatype TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    title TEXT,
+    overview TEXT,
+    year TEXT,
+    data TEXT NOT NULL,
+    run INTEGER NOT NULL,
+    UNIQUE (mediatype, item_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, overview, year, content='items', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, overview, year) VALUES (new.rowid, new.title, new.overview, new.year);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, overview, year)
+    VALUES ('delete', old.rowid, old.title, old.overview, old.year);
+END;
+DROP TRIGGER IF EXISTS items_au;
+CREATE TRIGGER items_au AFTER UPDATE OF title, overview, year ON items
+WHEN old.title IS NOT new.title OR old.overview IS NOT new.overview OR old.year IS NOT new.year BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, overview, year)
+    VALUES ('delete', old.rowid, old.title, old.overview, old.year);
+    INSERT INTO items_fts (rowid, title, overview, year) VALUES (new.rowid, new.title, new.overview, new.year);
+END;
+CREATE TABLE IF NOT EXISTS synced (
+    mediatype TEXT PRIMARY KEY,
+    finished REAL NOT NULL
+);
+'''
+
+# Seconds after the last completed sync before the index is considered stale.
+MAX_AGE = 7 * 24 * 3600
+
+
+def match_expression(query):
+    """
+    Turn user input into an FTS5 query matching every word as a prefix.
+    """
+    words = re.findall(r'\w+', query, re.UNICODE)
+
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchIndex:
+    """
+    FTS5 index of movies and series.
+
+    :param path: database file, e.g. <profile>/search.db
+    :param run: id of the sync, a resumed sync passes the id of the interrupted one
+    :param readonly: open an existing index for searching only, it never waits on a running sync
+    :raises sqlite3.OperationalError: if SQLite was built without FTS5
+    """
+
+    def __init__(self, path, run=None, readonly=False):
+        self.run = run or int(time.time() * 1000)
+        self.readonly = readonly
+
+        if readonly:
+            self._db = sqlite3.connect(f'file:{pathname2url(path)}?mode=ro', uri=True, timeout=10)
+            return
+
+        self._db = sqlite3.connect(path, timeout=10)
+        # Searches keep reading the last committed sync while a sync writes.
+        self._db.execute('PRAGMA journal_mode=WAL')
+
+        if self._db.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            self._db.executescript(f'{SCHEMA}PRAGMA user_version = {SCHEMA_VERSION};')
+
+    def add(self, mediatype, item):
+        """
+        Insert or update an item. The FTS index is only rewritten when the title,
+        overview or year changed.
+        """
+        self._db.execute(
+            'INSERT INTO items (mediatype, item_id, title, overview, year, data, run) VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (mediatype, item_id) DO UPDATE SET '
+            'title = excluded.title, overview = excluded.overview, year = excluded.year, '
+            'data = excluded.data, run = excluded.run',
+            (mediatype, str(item.get('id')), item.get('title'), item.get('overview'),
+             None if item.get('year') is None else str(item.get('year')),
+             json.dumps(item, separators=(',', ':')), self.run))
+
+    def finish(self, mediatype):
+        """
+        Drop items that were not seen by this sync and mark the index fresh.
+        """
+        self._db.execute('DELETE FROM items WHERE mediatype = ? AND run != ?', (mediatype, self.run))
+        self._db.execute('INSERT OR REPLACE INTO synced (mediatype, finished) VALUES (?, ?)', (mediatype, time.time()))
+        self._db.commit()
+
+    def fresh(self, max_age=MAX_AGE):
+        """
+        Whether movies and series were both synced within max_age seconds.
+        """
+        rows = dict(self._db.execute('SELECT mediatype, finished FROM synced'))
+
+        return all(time.time() - rows.get(mediatype, 0) <= max_age for mediatype in ('movies', 'series'))
+
+    def search(self, query, limit=100):
+        """
+        Find movies and series matching all words of the query as prefixes.
+
+        :return: items as returned by the API, with an added 'mediatype' key
+        :rtype: list
+        """
+        expression = match_expression(query)
+
+        if not expression:
+            return []
+
+        results = []
+
+        for mediatype, data in self._db.execute(
+                'SELECT items.mediatype, items.data FROM items_fts JOIN items ON items.rowid = items_fts.rowid '
+                'WHERE items_fts MATCH ? ORDER BY bm25(items_fts, 10.0, 1.0, 2.0) LIMIT ?', (expression, limit)):
+            item = json.loads(data)
+            item['mediatype'] = mediatype
+            results.append(item)
+
+        return results
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        if not self.readonly:
+            self._db.commit()
+        self._db.close()
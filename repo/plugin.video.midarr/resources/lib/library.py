@@ -0,0 +1,172 @@
+"""
+Incremental writer for the .strm library.
+
+Every file written by a sync is recorded in a manifest (path, content hash and
+item id). A later sync only touches files whose content changed and removes the
+ones that are no longer produced, so Kodi's library scanner sees the real
+changes instead of a freshly recreated tree.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    item_id TEXT,
+    hash TEXT NOT NULL,
+    run INTEGER NOT NULL
+);
+'''
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class LibraryWriter:
+    """
+    Write files below a library root, skipping the ones that did not change.
+
+    :param root: library directory, e.g. <profile>/movies
+    :param manifest_path: manifest database, shared by all library roots
+    :param run: id of the sync, a resumed sync passes the id of the interrupted one
+    """
+
+    def __init__(self, root, manifest_path, run=None):
+        self.root = root
+        self.prefix = os.path.basename(os.path.normpath(root)) + '/'
+        self.run = run or int(time.time() * 1000)
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(manifest_path, timeout=10)
+        self._db.executescript(SCHEMA)
+        self._known = {}
+        # Items that wrote each path during this run, a resumed run inherits them.
+        self._owners = {}
+
+        for path, item_id, file_hash, run in self._db.execute(
+                'SELECT path, item_id, hash, run FROM files WHERE path LIKE ?', (self.prefix + '%',)):
+            self._known[path] = file_hash
+
+            if run == self.run:
+                self._owners[path] = item_id
+
+    def _relative(self, path):
+        return self.prefix + os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def taken(self, path, item_id):
+        """
+        Whether another item already wrote path during this run, e.g. a movie with the same title.
+        """
+        owner = self._owners.get(self._relative(path))
+
+        return owner is not None and owner != (None if item_id is None else str(item_id))
+
+    def write(self, path, content, item_id=None):
+        """
+        Write a file unless it already holds the same content.
+
+        :param path: absolute path below the library root
+        :param content: file content
+        :param item_id: Midarr id of the item the file belongs to
+        :return: True if the file was created or updated
+        :rtype: bool
+        """
+        relative = self._relative(path)
+        file_hash = content_hash(content)
+        known_hash = self._known.get(relative)
+        exists = os.path.exists(path)
+
+        # Files from before the manifest existed are adopted if their content matches.
+        if known_hash is None and exists:
+            with open(path, encoding='utf-8') as existing:
+                known_hash = content_hash(existing.read())
+
+        changed = not exists or known_hash != file_hash
+
+        if changed:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write next to the target and swap it in so the scanner never sees a partial file.
+            temporary = f'{path}.tmp'
+
+            with open(temporary, 'w', encoding='utf-8') as file:
+                file.write(content)
+
+            os.replace(temporary, path)
+            (self.updated if exists else self.created).append(path)
+
+        self._known[relative] = file_hash
+        self._owners[relative] = None if item_id is None else str(item_id)
+        self._db.execute('INSERT OR REPLACE INTO files (path, item_id, hash, run) VALUES (?, ?, ?, ?)',
+                         (relative, None if item_id is None else str(item_id), file_hash, self.run))
+
+        return changed
+
+    def finish(self):
+        """
+        Remove files that were not written by this run and save the manifest.
+
+        Only call this after a complete sync, otherwise files that were simply
+        not reached yet would be deleted.
+        """
+        stale = [path for (path,) in self._db.execute(
+            'SELECT path FROM files WHERE path LIKE ? AND run != ?', (self.prefix + '%', self.run))]
+        tracked = set(self._known)
+
+        # Untracked files are leftovers from syncs that predate the manifest.
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                relative = self._relative(os.path.join(directory, filename))
+
+                if relative not in tracked:
+                    stale.append(relative)
+
+        for relative in stale:
+            path = os.path.join(self.root, *relative[len(self.prefix):].split('/'))
+
+            try:
+                os.remove(path)
+                self.deleted.append(path)
+            except FileNotFoundError:
+                pass
+
+            self._prune(os.path.dirname(path))
+
+        self._db.executemany('DELETE FROM files WHERE path = ?', [(relative,) for relative in stale])
+        self.close()
+
+    def _prune(self, directory):
+        # Remove directories left empty, but never the library root itself.
+        while os.path.normpath(directory) != os.path.normpath(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+
+            directory = os.path.dirname(directory)
+
+    def commit(self):
+        """
+        Save the manifest for everything written so far, e.g. before a checkpoint.
+        Does nothing once finish() or close() saved it.
+        """
+        if self._db is None:
+            return
+
+        self._db.commit()
+
+    def close(self):
+        """
+        Save the manifest for everything written so far.
+        """
+        if self._db is None:
+            return
+
+        self._db.commit()
+        self._db.close()
+        self._db = None
@@ -0,0 +1,198 @@
+"""
+Builds a page of Kodi ListItems and submits it in one call.
+"""
+from urllib.parse import urlencode
+
+import xbmcgui
+import xbmcplugin
+
+
+def proxy_art_url(proxy, path, art_type):
+    """
+    URL of an image on the local proxy, it stays the same when the server address or token change.
+
+    :param proxy: URL of the running proxy, see resources.lib.proxy.LocalProxy
+    :param path: image path as returned by the API
+    :param art_type: Kodi art type, e.g. poster
+    """
+    return f"{proxy}/art/{art_type}?{urlencode({'path': path})}"
+
+
+def render_item(record):
+    """
+    Create a ListItem from its plain description, see ListingBuilder.snapshot.
+
+    :param record: label, art, info and playable
+    :rtype: xbmcgui.ListItem
+    """
+    # offscreen=True skips the GUI locking Kodi does for items that are already on screen.
+    list_item = xbmcgui.ListItem(label=record['label'], offscreen=True)
+
+    if record.get('art'):
+        list_item.setArt(record['art'])
+
+    info = record.get('info')
+
+    if info:
+        # 'mediatype' is needed for skin to display info for this ListItem correctly.
+        info_tag = list_item.getVideoInfoTag()
+        info_tag.setMediaType(info['mediatype'])
+        info_tag.setTitle(info['title'])
+        info_tag.setPlot(info['plot'])
+        if 'year' in info:
+            info_tag.setYear(info['year'])
+        if info.get('genres'):
+            info_tag.setGenres(info['genres'])
+
+    if record.get('playable'):
+        # This is mandatory for playable items!
+        list_item.setProperty('IsPlayable', 'true')
+
+    return list_item
+
+
+class ListingBuilder:
+    """
+    Collects the items of a virtual folder.
+
+    Server settings are read once per invocation instead of once per item and
+    the whole page is handed to Kodi with a single addDirectoryItems call.
+
+    :param handle: plugin handle
+    :param get_url: function creating plugin call URLs
+    :param settings: addon settings
+    :param artwork: optional local artwork cache
+    :type artwork: resources.lib.artwork.ArtworkCache
+    :param proxy: optional URL of the local proxy that serves the artwork
+    """
+
+    def __init__(self, handle, get_url, settings, artwork=None, proxy=None):
+        self.handle = handle
+        self.get_url = get_url
+        self.baseurl = settings.getString('baseurl')
+        self.token = settings.getString('apitoken')
+        self.artwork = artwork
+        self.proxy = proxy
+        self.items = []
+        # (path, art type) of images that are not in the artwork cache yet.
+        self.missing_art = []
+        # Stream URLs of the playable items.
+        self.streams = []
+        # [url, is folder, record] of every item, enough to show the folder again, see render_item.
+        self.snapshot = []
+        # Records of the items create_item returned, by id() until they are added.
+        self._records = {}
+
+    def server_url(self, path):
+        """
+        Create an authenticated Midarr URL for a path returned by the API.
+        """
+        return f"{self.baseurl}{path}&token={self.token}"
+
+    def art_url(self, path, art_type):
+        """
+        Proxy URL for an image, or the local file if it is cached and its server URL otherwise.
+        """
+        # The proxy fills the artwork cache itself, and its URL never changes.
+        if self.proxy is not None:
+            return proxy_art_url(self.proxy, path, art_type)
+
+        if self.artwork is not None:
+            local = self.artwork.get(path, art_type)
+
+            if local is not None:
+                return local
+
+            self.missing_art.append((path, art_type))
+
+        return self.server_url(path)
+
+    def describe(self, video, mediatype, art, year=True, genres=None):
+        """
+        Plain description of the ListItem for a movie, series or episode, see render_item.
+
+        :param video: item as returned by the API
+        :param mediatype: media type for the InfoTag
+        :param art: mapping of Kodi art type to the API field holding its path
+        :param year: whether the item carries a year
+        :param genres: optional genres
+        :rtype: dict
+        """
+        info = {'mediatype': mediatype, 'title': video['title'], 'plot': video['overview']}
+
+        if year:
+            info['year'] = video['year']
+        if genres:
+            info['genres'] = genres
+
+        return {
+            'label': video['title'],
+            'art': {art_type: self.art_url(video[field], art_type) for art_type, field in art.items()},
+            'info': info,
+        }
+
+    def create_item(self, video, mediatype, art, year=True, genres=None):
+        """
+        Create a ListItem for a movie, series or episode, see describe.
+
+        :rtype: xbmcgui.ListItem
+        """
+        record = self.describe(video, mediatype, art, year, genres)
+        list_item = render_item(record)
+        self._records[id(list_item)] = record
+
+        return list_item
+
+    def _add(self, url, list_item, is_folder, record):
+        self.items.append((url, list_item, is_folder))
+        self.snapshot.append([url, is_folder, record])
+
+    def add_playable(self, video, mediatype, art, year=True, genres=None):
+        """
+        Add an item that plays the video's stream.
+        """
+        record = self.describe(video, mediatype, art, year, genres)
+        record['playable'] = True
+
+        stream = self.server_url(video['stream'])
+        self.streams.append(stream)
+        self._add(self.get_url(action='play', video=stream), render_item(record), False, record)
+
+    def add_folder(self, url, list_item):
+        """
+        Add an item that opens a sub-listing.
+        """
+        # Items from elsewhere, e.g. "Next Page...", only carry a label.
+        record = self._records.pop(id(list_item), None) or {'label': list_item.getLabel()}
+        self._add(url, list_item, True, record)
+
+    def submit(self):
+        """
+        Hand all collected items to Kodi.
+        """
+        xbmcplugin.addDirectoryItems(self.handle, self.items, len(self.items))
+
+    def submit_snapshot(self, snapshot):
+        """
+        Hand the items of an earlier snapshot to Kodi, the collected items are left alone.
+
+        :param snapshot: ListingBuilder.snapshot of an earlier invocation
+        """
+        items = [(url, render_item(record), is_folder) for url, is_folder, record in snapshot]
+        xbmcplugin.addDirectoryItems(self.handle, items, len(items))
+
+    def download_missing_art(self, limit=None):
+        """
+        Download the images that were not cached, for the next time the folder is shown.
+
+        Call this after endOfDirectory, it blocks until the downloads finished.
+
+        :param limit: most images to download, the first ones of the listing; None for all
+        """
+        if self.artwork is None:
+            return
+
+        for path, art_type in self.missing_art[:limit]:
+            self.artwork.queue(path, art_type)
+
+        self.artwork.wait()
@@ -0,0 +1,98 @@
+"""
+Kodi .nfo files for the library sync.
+
+They are written next to the .strm files and carry the metadata the API already
+returned, so Kodi imports movies, shows and episodes without looking them up
+with an online scraper. See https://kodi.wiki/view/NFO_files
+
+The output only depends on the item, so an unchanged item produces the same
+file and LibraryWriter leaves it alone.
+"""
+from xml.etree import ElementTree
+
+DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>\n'
+
+
+def _add(parent, tag, text, **attributes):
+    # Missing values are left out instead of written as empty tags.
+    if text is None or text == '':
+        return None
+
+    element = ElementTree.SubElement(parent, tag, attributes)
+    element.text = str(text)
+
+    return element
+
+
+def _details(root, item, art_url):
+    _add(root, 'title', item.get('title'))
+    _add(root, 'plot', item.get('overview'))
+    _add(root, 'year', item.get('year'))
+
+    for genre in item.get('genres') or ():
+        _add(root, 'genre', genre)
+
+    _add(root, 'uniqueid', item.get('id'), type='midarr', default='true')
+
+    if item.get('poster'):
+        _add(root, 'thumb', art_url(item['poster'], 'poster'), aspect='poster')
+
+    if item.get('background'):
+        _add(ElementTree.SubElement(root, 'fanart'), 'thumb', art_url(item['background'], 'fanart'))
+
+
+def _serialize(root):
+    return DECLARATION + ElementTree.tostring(root, encoding='unicode') + '\n'
+
+
+def movie_nfo(video, art_url):
+    """
+    <movie> document for a movie returned by the API.
+
+    :param video: movie
+    :param art_url: function turning an API image path and Kodi art type into a URL
+    :rtype: str
+    """
+    root = ElementTree.Element('movie')
+    _details(root, video, art_url)
+
+    return _serialize(root)
+
+
+def tvshow_nfo(series, art_url):
+    """
+    <tvshow> document for a series returned by the API.
+
+    :param series: series
+    :param art_url: function turning an API image path and Kodi art type into a URL
+    :rtype: str
+    """
+    root = ElementTree.Element('tvshow')
+    _details(root, series, art_url)
+
+    return _serialize(root)
+
+
+def episode_nfo(episode, series, season, number, art_url):
+    """
+    <episodedetails> document for an episode returned by the API.
+
+    :param episode: episode
+    :param series: series the episode belongs to
+    :param season: season number
+    :param number: episode number within the season
+    :param art_url: function turning an API image path and Kodi art type into a URL
+    :rtype: str
+    """
+    root = ElementTree.Element('episodedetails')
+    _add(root, 'title', episode.get('title'))
+    _add(root, 'showtitle', series.get('title'))
+    _add(root, 'season', season)
+    _add(root, 'episode', number)
+    _add(root, 'plot', episode.get('overview'))
+    _add(root, 'uniqueid', episode.get('id'), type='midarr', default='true')
+
+    if episode.get('screenshot'):
+        _add(root, 'thumb', art_url(episode['screenshot'], 'thumb'))
+
+    return _serialize(root)
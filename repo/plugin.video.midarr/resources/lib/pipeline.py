@@ -0,0 +1,111 @@
+"""
+Bounded producer/consumer helpers for the library sync.
+
+Pages are fetched on a background thread while the caller writes files, and no
+stage holds more than a few pages or results at a time, so memory stays flat
+regardless of library size.
+"""
+import queue
+import threading
+from collections import deque
+
+# Pages fetched ahead of the consumer.
+DEFAULT_DEPTH = 2
+
+_DONE = object()
+
+
+class PageStream:
+    """
+    Iterate over the items of a paged API listing.
+
+    A background thread fetches pages into a bounded queue until an empty page
+    is returned, so network I/O overlaps with whatever the consumer does with
+    the items.
+
+    :param fetch_page: function taking a page number and returning (items, total)
+    :param depth: number of pages that may wait in the queue
+    :param first_page: page to start from
+    """
+
+    def __init__(self, fetch_page, depth=DEFAULT_DEPTH, first_page=1):
+        self.fetch_page = fetch_page
+        self.first_page = first_page
+        self.total = None
+        # Number of the page the last yielded item belongs to.
+        self.page = None
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _put(self, value):
+        # Block while the queue is full, but give up as soon as the consumer stops.
+        while not self._stop.is_set():
+            try:
+                self._queue.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _produce(self):
+        page = self.first_page
+
+        try:
+            while not self._stop.is_set():
+                items, total = self.fetch_page(page)
+
+                if self.total is None:
+                    self.total = total
+
+                if not items or not self._put((page, items)):
+                    break
+
+                page += 1
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self):
+        try:
+            while True:
+                value = self._queue.get()
+
+                if value is _DONE:
+                    return
+                if isinstance(value, Exception):
+                    raise value
+
+                self.page, items = value
+
+                yield from items
+        finally:
+            self.close()
+
+    def close(self):
+        self._stop.set()
+
+
+def ordered_map(executor, function, iterable, window):
+    """
+    Like executor.map, but with at most ``window`` calls in flight.
+
+    executor.map submits the whole input up front. This keeps only a bounded
+    window of pending results, consumes the input lazily and still yields
+    ``(argument, result)`` pairs in input order.
+    """
+    pending = deque()
+
+    for argument in iterable:
+        pending.append((argument, executor.submit(function, argument)))
+
+        if len(pending) >= window:
+            argument, future = pending.popleft()
+            yield argument, future.result()
+
+    while pending:
+        argument, future = pending.popleft()
+        yield argument, future.result()
@@ -0,0 +1,328 @@
+"""
+Local HTTP server for artwork and streams, runs in the background service.
+
+Kodi's texture cache is keyed by image URL. Server URLs carry the API token and
+the server address, so rotating the token or switching between a LAN and a WAN
+address made every client download all posters and fanart again. ListItems
+and .nfo files point at this server instead: a fixed loopback port and the
+image path the API returns, neither of which changes with the settings. The
+server authenticates against Midarr with whatever the settings are right now.
+
+Streams can be played through the server as well, see resources.lib.readahead.
+"""
+import mimetypes
+import os
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import xbmc
+
+from resources.lib.client import ApiError
+from resources.lib.readahead import CHUNK_SIZE
+from resources.lib.scheduler import FOREGROUND, priority
+
+# Loopback port the server listens on, changing it changes every art URL.
+DEFAULT_PORT = 52180
+# Seconds Kodi may use an image without asking again.
+MAX_AGE = 30 * 24 * 3600
+# API endpoint of the image paths in API responses. Nothing else is fetched,
+# the proxy adds the token and any local process may call it.
+IMAGE_PATH = '/api/images'
+
+
+def is_image_path(path):
+    """
+    Whether a path= parameter is an image path as the API returns it.
+    """
+    parts = urlsplit(path)
+
+    return not parts.scheme and not parts.netloc and parts.path == IMAGE_PATH
+
+
+def parse_range(header):
+    """
+    First byte and last byte (None for the end) of a single range request header,
+    a negative first byte counts from the end. None if the header is missing or
+    asks for several ranges.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+
+    first, _, last = header[len('bytes='):].strip().partition('-')
+
+    if not first:
+        return -int(last), None
+
+    return int(first), int(last) if last else None
+
+
+class LocalProxy(ThreadingHTTPServer):
+    """
+    Serves /art/<art type>?path=<API image path> from the artwork cache, and
+    /stream?url=<stream URL> and /prefetch?url=<stream URL> from read-ahead buffers.
+
+    Clients and caches are looked up on every request, so a settings change is
+    picked up without restarting the server.
+
+    :param port: loopback port
+    :param get_client: function returning the API client
+    :param get_artwork: function returning the artwork cache, or None if it is disabled
+    :param directory: scratch directory for images served without the artwork cache
+    :param streams: read-ahead buffers, None to not serve streams
+    :type streams: resources.lib.readahead.Streams
+    :param redirect_target: function returning where a stream URL redirects to,
+        or None to let the upstream request follow it
+    """
+    daemon_threads = True
+
+    def __init__(self, port, get_client, get_artwork, directory, streams=None, redirect_target=None):
+        super().__init__(('127.0.0.1', port), Handler)
+        os.makedirs(directory, exist_ok=True)
+        self.get_client = get_client
+        self.get_artwork = get_artwork
+        self.directory = directory
+        self.streams = streams
+        self.redirect_target = redirect_target or (lambda url: None)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+        if self.streams is not None:
+            self.streams.close()
+
+    def upstream(self, url):
+        """
+        URL to read a stream from, None unless it is on the Midarr server.
+
+        Any local process may call the proxy, it must not fetch from other hosts
+        or fill the head cache with their content. Redirect targets are only
+        taken from the resolve cache.
+        """
+        baseurl = urlsplit(self.get_client().baseurl)
+        parts = urlsplit(url)
+
+        if (parts.scheme, parts.netloc) != (baseurl.scheme, baseurl.netloc):
+            return None
+        if not parts.path.startswith(f"{baseurl.path.rstrip('/')}/"):
+            return None
+
+        return self.redirect_target(url) or url
+
+    def fetch_art(self, path, art_type):
+        """
+        Local file of an image, its MIME type and whether it is a scratch copy to
+        remove after serving it.
+
+        :raises ApiError: if the server does not have the image
+        """
+        artwork = self.get_artwork()
+
+        if artwork is not None:
+            file = artwork.fetch(path, art_type)
+
+            return file, mimetypes.guess_type(file)[0], False
+
+        # Scratch files are named per thread, Kodi loads several images at once.
+        temporary = os.path.join(self.directory, f'{threading.get_ident()}.download')
+        response = self.get_client().download(path, temporary)
+
+        return temporary, response.headers.get('Content-Type'), True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        xbmc.log(f"Local proxy: {format % args}", xbmc.LOGDEBUG)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        segments = parts.path.strip('/').split('/')
+
+        if segments[0] in ('stream', 'prefetch') and self.server.streams is not None and 'url' in query:
+            url = query['url'][0]
+            upstream = self.server.upstream(url)
+
+            if upstream is None:
+                return self.send_empty(404)
+            if segments[0] == 'prefetch':
+                return self.prefetch(url, upstream)
+
+            return self.send_stream(url, upstream)
+
+        if len(segments) != 2 or segments[0] != 'art' or 'path' not in query or not is_image_path(query['path'][0]):
+            return self.send_empty(404)
+
+        try:
+            # Kodi asks for the images of the listing the user looks at.
+            with priority(FOREGROUND):
+                file, mimetype, temporary = self.server.fetch_art(query['path'][0], segments[1])
+        except ApiError as e:
+            return self.send_empty(404 if e.status == 404 else 502)
+        except Exception as e:
+            xbmc.log(f"Local proxy failed to fetch {parts.path}: {e}", xbmc.LOGWARNING)
+            return self.send_empty(502)
+
+        try:
+            self.send_file(file, mimetype)
+        finally:
+            if temporary:
+                os.remove(file)
+
+    def send_empty(self, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def prefetch(self, url, upstream):
+        try:
+            self.server.streams.prefetch(url, upstream)
+        except Exception as e:
+            xbmc.log(f"Local proxy failed to prefetch a stream: {e}", xbmc.LOGWARNING)
+            return self.send_empty(502)
+
+        self.send_empty(204)
+
+    def send_stream(self, url, upstream):
+        """
+        Serve a stream, the head cache is keyed by the server URL and the data read from upstream.
+        """
+        streams = self.server.streams
+        requested = parse_range(self.headers.get('Range'))
+        first, last = requested or (0, None)
+        head = streams.head(url)
+        size, mimetype, data, validator = head if head is not None else (None, None, b'', None)
+        reader = None
+
+        if size is None and first < 0:
+            # Kodi reads the index at the end of a file while the start is still playing.
+            size, mimetype = streams.size(upstream) or (None, None)
+
+        try:
+            if first < 0 and size is None:
+                # Counted from the end, the size is needed first.
+                reader = streams.acquire(upstream, 0)
+                reader.wait_ready()
+                size, mimetype = reader.size, reader.mimetype
+
+            offset = first if first >= 0 else max(0, size + first)
+
+            if offset < len(data):
+                # The head is sent from disk, the connection for the rest reads on behind it.
+                offset = max(0, min(len(data), size - 1))
+
+            reader = self._acquire(reader, upstream, offset)
+            reader.wait_ready()
+
+            if head is not None and (reader.size != size or reader.validator != validator):
+                # The file was replaced since its head was kept, e.g. by a better release.
+                streams.drop_head(url)
+                data = b''
+                reader = self._acquire(reader, upstream, first if first >= 0 else max(0, reader.size + first))
+                reader.wait_ready()
+
+            size, mimetype = reader.size, reader.mimetype
+        except Exception as e:
+            if reader is not None:
+                streams.release(reader)
+            xbmc.log(f"Local proxy failed to open a stream: {e}", xbmc.LOGWARNING)
+            return self.send_empty(502)
+
+        if first < 0:
+            first = max(0, size + first)
+
+        try:
+            self._send_range(url, reader, size, mimetype, data, requested is not None, first, last)
+        except (BrokenPipeError, ConnectionResetError):
+            # Kodi closes the connection when it seeks or stops.
+            self.close_connection = True
+        finally:
+            streams.release(reader)
+
+    def _acquire(self, reader, upstream, offset):
+        # The reader already held is kept if it has offset buffered.
+        if reader is not None:
+            if reader.covers(offset):
+                return reader
+
+            self.server.streams.release(reader)
+
+        return self.server.streams.acquire(upstream, offset)
+
+    def _send_range(self, url, reader, size, mimetype, data, ranged, first, last):
+        if size is None:
+            # Without a size Kodi cannot seek, the stream is passed through as it comes.
+            ranged, last = False, None
+            self.send_response(200)
+            self.close_connection = True
+        elif first >= size:
+            return self.send_empty(416, [('Content-Range', f'bytes */{size}')])
+        else:
+            last = size - 1 if last is None else min(last, size - 1)
+            self.send_response(206 if ranged else 200)
+            self.send_header('Content-Length', str(last - first + 1))
+            if ranged:
+                self.send_header('Content-Range', f'bytes {first}-{last}/{size}')
+
+        self.send_header('Content-Type', mimetype or 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        streams = self.server.streams
+        # A stream played from the start fills the head cache for the next time.
+        head = bytearray() if first == 0 and not data and streams.heads.head_size else None
+        position = first
+
+        while last is None or position <= last:
+            wanted = CHUNK_SIZE if last is None else min(CHUNK_SIZE, last + 1 - position)
+
+            if position < len(data):
+                chunk = data[position:position + wanted]
+            else:
+                chunk = reader.read(position, wanted)
+
+            if not chunk:
+                break
+
+            self.wfile.write(chunk)
+            position += len(chunk)
+
+            if head is not None:
+                head += chunk[:streams.heads.head_size - len(head)]
+
+                if len(head) >= streams.heads.head_size:
+                    streams.keep_head(url, size, mimetype, bytes(head), reader.validator)
+                    head = None
+
+        if head and size is not None and position >= size:
+            # Shorter than the head size.
+            streams.keep_head(url, size, mimetype, bytes(head), reader.validator)
+
+    def send_file(self, file, mimetype):
+        with open(file, 'rb') as source:
+            self.send_response(200)
+            self.send_header('Content-Type', mimetype or 'image/jpeg')
+            self.send_header('Content-Length', str(os.fstat(source.fileno()).st_size))
+            self.send_header('Cache-Control', f'max-age={MAX_AGE}')
+            self.end_headers()
+            shutil.copyfileobj(source, self.wfile)
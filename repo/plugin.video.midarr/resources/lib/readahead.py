@@ -0,0 +1,399 @@
+"""
+Read-ahead buffering of video streams for the local proxy.
+
+Kodi opens a new connection for every seek and reads through its own cache,
+whose size applies to every source. The proxy keeps the upstream connection
+to Midarr open instead, reads a window ahead of what Kodi consumed into memory
+and serves a seek from that buffer when it lands inside it.
+
+The first megabytes of recently browsed and played titles are kept on disk
+(the head cache), so playback starts from local data instead of waiting for
+them to download. A head is only used while the size and validator of the
+upstream response still match the ones it was kept with.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from urllib.request import Request, urlopen
+
+# Bytes read from the upstream connection at a time.
+CHUNK_SIZE = 256 * 1024
+# Bytes kept behind the read position, so a short seek back is served from memory.
+KEEP_BEHIND = 2 * 1024 * 1024
+# A seek at most this far past the buffered data waits for the reader instead
+# of opening a new connection.
+MAX_GAP = 2 * 1024 * 1024
+# Seconds an idle reader is kept for the next request of the same stream.
+IDLE_TIMEOUT = 30
+# Readers kept open at once, Kodi opens a second connection e.g. for an index at the end of a file.
+MAX_READERS = 4
+# Seconds to wait for the upstream server.
+TIMEOUT = 15
+# Default disk budget of the head cache in bytes.
+DEFAULT_HEAD_CACHE_SIZE = 256 * 1024 * 1024
+
+HEADERS = {'User-Agent': 'plugin.video.midarr'}
+
+
+def stream_key(url):
+    """
+    Cache key of a stream URL, the API token is left out.
+    """
+    parts = urlsplit(url)
+    query = urlencode([(name, value) for name, value in parse_qsl(parts.query) if name != 'token'])
+
+    return hashlib.sha1(urlunsplit(parts._replace(query=query)).encode('utf-8')).hexdigest()
+
+
+def _open(url, offset, length=None):
+    """
+    Open a stream at offset.
+
+    :return: response, total size (None if the server did not say), MIME type and validator
+    """
+    end = '' if length is None else offset + length - 1
+    response = urlopen(Request(url, headers=dict(HEADERS, Range=f'bytes={offset}-{end}')), timeout=TIMEOUT)
+    content_range = response.headers.get('Content-Range', '')
+    length = response.headers.get('Content-Length')
+
+    if response.status == 206 and '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        size = int(content_range.rsplit('/', 1)[1])
+    elif response.status == 200 and length and length.isdigit():
+        size = int(length)
+
+        # The server ignored the range, skip to the offset ourselves.
+        remaining = offset
+        while remaining > 0:
+            skipped = len(response.read(min(CHUNK_SIZE, remaining)))
+            if not skipped:
+                break
+            remaining -= skipped
+    else:
+        size = None
+
+    return response, size, response.headers.get('Content-Type'), validator(response.headers)
+
+
+def validator(headers):
+    """
+    What identifies the version of a stream, to tell whether a kept head still belongs to it.
+
+    :rtype: list
+    """
+    return [headers.get('ETag'), headers.get('Last-Modified')]
+
+
+class ReadAhead:
+    """
+    One upstream connection, read up to window bytes ahead of the consumer on a thread.
+
+    :param url: stream URL
+    :param offset: byte to start at
+    :param window: bytes to read ahead
+    """
+
+    def __init__(self, url, offset, window):
+        self.url = url
+        self.window = window
+        self.size = None
+        self.mimetype = None
+        self.validator = None
+        self.error = None
+        self.busy = False
+        self.used = time.monotonic()
+        self._base = offset
+        self._position = offset
+        self._buffer = bytearray()
+        self._eof = False
+        self._closed = False
+        self._ready = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def end(self):
+        return self._base + len(self._buffer)
+
+    def _run(self):
+        try:
+            response, self.size, self.mimetype, self.validator = _open(self.url, self._base)
+        except Exception as e:
+            self.error = e
+            self._ready.set()
+            return
+
+        self._ready.set()
+
+        with response:
+            while True:
+                with self._cond:
+                    while not self._closed and self.end - self._position >= self.window:
+                        self._cond.wait()
+
+                    if self._closed:
+                        return
+
+                try:
+                    data = response.read(CHUNK_SIZE)
+                except Exception as e:
+                    data = b''
+                    self.error = e
+
+                with self._cond:
+                    if not data:
+                        self._eof = True
+                        self._cond.notify_all()
+                        return
+
+                    self._buffer += data
+
+                    # Drop what the consumer left behind, beyond what a short seek back needs.
+                    drop = self._position - KEEP_BEHIND - self._base
+                    if drop > 0:
+                        del self._buffer[:drop]
+                        self._base += drop
+
+                    self._cond.notify_all()
+
+    def wait_ready(self):
+        """
+        Wait for the response headers.
+
+        :raises Exception: whatever opening the stream raised
+        """
+        if not self._ready.wait(TIMEOUT) and self.error is None:
+            self.error = TimeoutError(f'No response for {self.url}')
+
+        if self.error is not None and self.size is None:
+            raise self.error
+
+    def covers(self, offset):
+        with self._cond:
+            return not self._closed and self._base <= offset <= self.end + MAX_GAP
+
+    def read(self, offset, length=CHUNK_SIZE):
+        """
+        Read from the buffer, waiting for the reader if needed.
+
+        :return: bytes at offset, empty at the end of the stream
+        :raises ValueError: if offset is no longer buffered
+        """
+        with self._cond:
+            while self.end <= offset and not self._eof and not self._closed:
+                self._cond.wait(TIMEOUT)
+
+            if offset < self._base:
+                raise ValueError(f'Offset {offset} is no longer buffered')
+
+            if self.end <= offset:
+                if self.error is not None:
+                    raise self.error
+                return b''
+
+            start = offset - self._base
+            data = bytes(self._buffer[start:start + length])
+            self._position = offset + len(data)
+            # There is room for the reader again.
+            self._cond.notify_all()
+
+            return data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class HeadCache:
+    """
+    First bytes of streams on disk, least recently used ones are evicted.
+
+    :param directory: cache directory, e.g. <profile>/streams
+    :param head_size: bytes kept per stream
+    :param max_size: disk budget in bytes
+    """
+
+    def __init__(self, directory, head_size, max_size=DEFAULT_HEAD_CACHE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.head_size = head_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+
+        return f'{base}.json', f'{base}.data'
+
+    def get(self, key):
+        """
+        :return: total size, MIME type, the first bytes and the validator of a stream, or None
+        :rtype: tuple or None
+        """
+        meta_path, data_path = self._paths(key)
+
+        try:
+            with open(meta_path, encoding='utf-8') as file:
+                meta = json.load(file)
+            with open(data_path, 'rb') as file:
+                data = file.read()
+            # The modification time orders the eviction.
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+
+        # Heads kept before validators were stored have none and never match.
+        return meta['size'], meta['mimetype'], data, meta.get('validator')
+
+    def put(self, key, size, mimetype, data, validator):
+        if not self.head_size or size is None:
+            return
+
+        meta_path, data_path = self._paths(key)
+        temporary = f'{data_path}.{threading.get_ident()}.tmp'
+
+        with open(temporary, 'wb') as file:
+            file.write(data[:self.head_size])
+
+        os.replace(temporary, data_path)
+
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump({'size': size, 'mimetype': mimetype, 'validator': validator}, file)
+
+        os.replace(temporary, meta_path)
+        self.evict()
+
+    def remove(self, key):
+        with self._lock:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        with self._lock:
+            files = []
+
+            for name in os.listdir(self.directory):
+                if name.endswith('.data'):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    files.append((stat.st_mtime, stat.st_size, name[:-len('.data')]))
+
+            total = sum(size for _, size, _ in files)
+
+            for _, size, key in sorted(files):
+                if total <= self.max_size:
+                    break
+
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+                total -= size
+
+
+class Streams:
+    """
+    Read-ahead readers and the head cache behind the proxy's /stream and /prefetch.
+
+    :param directory: head cache directory
+    :param window: bytes each reader reads ahead
+    :param head_size: bytes kept per stream in the head cache, 0 to keep none
+    """
+
+    def __init__(self, directory, window, head_size):
+        self.window = window
+        self.heads = HeadCache(directory, head_size)
+        self._readers = []
+        self._lock = threading.Lock()
+
+    def acquire(self, url, offset):
+        """
+        A reader positioned at offset, reused if an idle one has it buffered.
+
+        :rtype: ReadAhead
+        """
+        with self._lock:
+            now = time.monotonic()
+
+            for reader in list(self._readers):
+                if not reader.busy and now - reader.used > IDLE_TIMEOUT:
+                    reader.close()
+                    self._readers.remove(reader)
+
+            for reader in self._readers:
+                if reader.url == url and not reader.busy and reader.covers(offset):
+                    reader.busy = True
+                    return reader
+
+            idle = [reader for reader in self._readers if not reader.busy]
+
+            if len(self._readers) >= MAX_READERS and idle:
+                oldest = min(idle, key=lambda reader: reader.used)
+                oldest.close()
+                self._readers.remove(oldest)
+
+            reader = ReadAhead(url, offset, self.window)
+            reader.busy = True
+            self._readers.append(reader)
+
+            return reader
+
+    def release(self, reader):
+        with self._lock:
+            reader.busy = False
+            reader.used = time.monotonic()
+
+    def head(self, url):
+        """
+        See HeadCache.get.
+        """
+        return self.heads.get(stream_key(url))
+
+    def size(self, url):
+        """
+        Total size of a stream as far as an open reader knows it, or None.
+        """
+        with self._lock:
+            for reader in self._readers:
+                if reader.url == url and reader.size is not None:
+                    return reader.size, reader.mimetype
+
+        return None
+
+    def keep_head(self, url, size, mimetype, data, validator):
+        self.heads.put(stream_key(url), size, mimetype, data, validator)
+
+    def drop_head(self, url):
+        self.heads.remove(stream_key(url))
+
+    def prefetch(self, url, upstream=None):
+        """
+        Download the first bytes of a stream into the head cache unless they are there.
+
+        :param url: stream URL the head is kept under
+        :param upstream: URL to download from if it differs, e.g. a redirect target
+        """
+        if not self.heads.head_size or self.head(url) is not None:
+            return
+
+        response, size, mimetype, validator = _open(upstream or url, 0, self.heads.head_size)
+
+        with response:
+            data = response.read(self.heads.head_size)
+
+        self.keep_head(url, size, mimetype, data, validator)
+
+    def close(self):
+        with self._lock:
+            for reader in self._readers:
+                reader.close()
+
+            self._readers = []
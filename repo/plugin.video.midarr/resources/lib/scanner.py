@@ -0,0 +1,95 @@
+"""
+Targeted Kodi library updates after a sync.
+
+Instead of a full video library scan, Kodi is asked to scan only the
+directories a sync wrote files to and to clean only the ones it removed files
+from. Kodi runs one scan at a time, so the requests are sent one after the
+other, each once the previous scan finished.
+"""
+import os
+
+import xbmc
+
+# Directories updated one by one; above this one scan of the library root is cheaper.
+MAX_TARGETS = 50
+# Seconds to wait after each request before checking whether Kodi is still scanning.
+INTERVAL = 2
+
+
+def directories(root, paths, depth):
+    """
+    Directories below root that contain the given files, cut off at depth levels.
+
+    :param root: library root
+    :param paths: absolute file paths below root
+    :param depth: 0 for the root itself (movies share one folder), 1 for the
+        top-level folder (the show folder of an episode)
+    :rtype: set
+    """
+    found = set()
+
+    for path in paths:
+        parts = os.path.relpath(os.path.dirname(path), root).split(os.sep)
+        parts = [part for part in parts if part not in ('', '.')][:depth]
+        found.add(os.path.join(root, *parts))
+
+    return found
+
+
+def _kodi_path(directory):
+    # Kodi stores library paths with a trailing separator.
+    return os.path.join(directory, '')
+
+
+class LibraryUpdater:
+    """
+    Sends UpdateLibrary and CleanLibrary requests, one scan at a time.
+
+    :param monitor: xbmc.Monitor used to wait, stops waiting when Kodi shuts down
+    :param max_targets: directories above which the library root is scanned instead
+    """
+
+    def __init__(self, monitor, max_targets=MAX_TARGETS):
+        self.monitor = monitor
+        self.max_targets = max_targets
+
+    def _batch(self, root, targets):
+        targets = sorted(targets)
+
+        if len(targets) > self.max_targets:
+            return [root]
+
+        return targets
+
+    def _run(self, builtin):
+        xbmc.log(f"Library update: {builtin}", xbmc.LOGDEBUG)
+        xbmc.executebuiltin(builtin)
+
+        # Kodi starts the job asynchronously and ignores new ones while it is busy.
+        if self.monitor.waitForAbort(INTERVAL):
+            return False
+
+        while xbmc.getCondVisibility('Library.IsScanningVideo'):
+            if self.monitor.waitForAbort(1):
+                return False
+
+        return True
+
+    def update(self, root, changed, removed):
+        """
+        Scan the changed directories and clean the ones files were removed from.
+
+        :param root: library root
+        :param changed: directories with created or updated files, see directories
+        :param removed: directories files were removed from, see directories
+        """
+        for directory in self._batch(root, changed):
+            if not self._run(f'UpdateLibrary(video,"{_kodi_path(directory)}")'):
+                return
+
+        # A removed show takes its folder with it, clean its parent then.
+        cleaned = {directory if os.path.isdir(directory) else root for directory in removed}
+
+        for directory in self._batch(root, cleaned):
+            if not self._run(f'CleanLibrary(video,false,"{_kodi_path(directory)}")'):
+                return
@@ -0,0 +1,285 @@
+"""
+Outbound request scheduling for the Midarr API.
+
+Every attempt the client sends takes a slot first. Slots are limited by a token
+bucket (requests per second) and by a concurrency window that adapts like TCP
+congestion control: it grows by one slot per window of fast responses and is
+halved when the server answers 429 or 5xx, times out, or its time to first byte
+climbs well above the lowest one seen recently. A small NAS therefore sets the
+pace of a library sync instead of the number of threads the sync runs.
+
+Foreground requests (browsing) go before background ones (the library sync).
+Within a process waiting foreground requests are served first. Across
+processes, foreground requests touch a marker file in the addon profile and
+the background scheduler drops to a single request in flight while the marker
+is recent, so a sync running in the service does not slow down the listings
+opened by plugin invocations.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+FOREGROUND = 0
+BACKGROUND = 1
+
+# Seconds a foreground request keeps background traffic throttled.
+FOREGROUND_GRACE = 5
+# Seconds between touches and checks of the foreground marker.
+MARKER_INTERVAL = 1
+# The window shrinks when a response is this much slower than the baseline...
+LATENCY_FACTOR = 3
+# ...and at least this slow in seconds, so jitter on a fast LAN does not count.
+LATENCY_FLOOR = 0.5
+# Factor the window shrinks by, at most once per round trip: the responses to
+# requests sent before the window shrank report the same congestion again.
+DECREASE_FACTOR = 0.5
+# Seconds taken as the round trip until a latency was measured.
+DEFAULT_ROUND_TRIP = 0.1
+# Statuses that mean the server is overloaded.
+CONGESTION_STATUSES = (429, 500, 502, 503, 504)
+
+_local = threading.local()
+_default_priority = FOREGROUND
+
+
+def set_default_priority(priority):
+    """
+    Priority of requests sent by this process, e.g. BACKGROUND in the sync service.
+    """
+    global _default_priority
+
+    _default_priority = priority
+
+
+@contextmanager
+def priority(value):
+    """
+    Send the requests of the current thread with another priority.
+    """
+    previous = getattr(_local, 'priority', None)
+    _local.priority = value
+
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    value = getattr(_local, 'priority', None)
+
+    return _default_priority if value is None else value
+
+
+def inherit_priority(function):
+    """
+    Wrap a function to run with the priority of the calling thread, for work
+    handed to another thread, e.g. an executor.
+    """
+    value = current_priority()
+
+    def run(*args, **kwargs):
+        with priority(value):
+            return function(*args, **kwargs)
+
+    return run
+
+
+class Slot:
+    """
+    Permission to send one attempt, see RequestScheduler.slot.
+    """
+
+    def __init__(self):
+        self.latency = None
+        self.status = None
+
+    def record(self, latency, status):
+        """
+        Report the time to first byte and the status of the attempt.
+        """
+        self.latency = latency
+        self.status = status
+
+
+class NullScheduler:
+    """
+    Scheduler that never waits.
+    """
+
+    @contextmanager
+    def slot(self, deadline=None):
+        yield Slot()
+
+
+NULL_SCHEDULER = NullScheduler()
+
+
+class RequestScheduler:
+    """
+    Token bucket and adaptive concurrency window shared by all threads of a process.
+
+    :param rate: requests per second, 0 for no limit
+    :param max_window: most requests in flight at once
+    :param marker: foreground marker file shared by all processes, e.g.
+        <profile>/foreground; None to not coordinate with other processes
+    """
+
+    def __init__(self, rate=0, max_window=4, marker=None):
+        self.rate = rate
+        self.burst = max(1, rate)
+        self.max_window = max(1, max_window)
+        self.window = float(self.max_window)
+        self.marker = marker
+        self.inflight = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._waiting = [0, 0]
+        self._baseline = None
+        self._decreased = 0
+        self._marker_checked = 0
+        self._marker_touched = 0
+        # Modification time of the marker as this process left it, see _foreground_elsewhere.
+        self._marker_mtime = None
+        self._marker_recent = False
+        self._cond = threading.Condition()
+
+    def _foreground_elsewhere(self, now):
+        # Called with the lock held, the marker is looked at once per interval.
+        if self.marker is not None and now - self._marker_checked >= MARKER_INTERVAL:
+            self._marker_checked = now
+
+            try:
+                mtime = os.path.getmtime(self.marker)
+            except OSError:
+                self._marker_recent = False
+            else:
+                # A plugin invocation works in the background once its listing is
+                # shown, its own foreground requests do not count.
+                self._marker_recent = mtime != self._marker_mtime and time.time() - mtime < FOREGROUND_GRACE
+
+        return self._marker_recent
+
+    def _touch_marker(self, now):
+        if self.marker is None or now - self._marker_touched < MARKER_INTERVAL:
+            return
+
+        self._marker_touched = now
+
+        try:
+            with open(self.marker, 'a'):
+                os.utime(self.marker)
+            self._marker_mtime = os.path.getmtime(self.marker)
+        except OSError:
+            pass
+
+    def _limit(self, priority, now):
+        if priority == BACKGROUND and (self._waiting[FOREGROUND] or self._foreground_elsewhere(now)):
+            return 1
+
+        return max(1, int(self.window))
+
+    def _take_token(self, now):
+        """
+        Take a token from the bucket.
+
+        :return: 0 if a token was taken, otherwise seconds until the next one
+        """
+        if not self.rate:
+            return 0
+
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+
+        return (1 - self._tokens) / self.rate
+
+    def _acquire(self, priority, deadline):
+        with self._cond:
+            self._waiting[priority] += 1
+
+            try:
+                while True:
+                    now = time.monotonic()
+
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError('Deadline exceeded while waiting for a request slot')
+
+                    if priority == FOREGROUND:
+                        self._touch_marker(now)
+
+                    delay = MARKER_INTERVAL
+
+                    if self.inflight < self._limit(priority, now):
+                        delay = self._take_token(now)
+
+                        if not delay:
+                            break
+
+                    if deadline is not None:
+                        delay = min(delay, deadline - now)
+
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[priority] -= 1
+
+            self.inflight += 1
+
+    def _decrease(self, now):
+        round_trip = DEFAULT_ROUND_TRIP if self._baseline is None else self._baseline
+
+        if now - self._decreased >= round_trip:
+            self.window = max(1.0, self.window * DECREASE_FACTOR)
+            self._decreased = now
+
+    def _release(self, slot, failed):
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+
+            if failed or slot.status in CONGESTION_STATUSES:
+                self._decrease(now)
+            elif slot.latency is not None:
+                # The lowest recent latency, allowed to creep up so a server that
+                # became slower for good gets a new baseline.
+                if self._baseline is None or slot.latency < self._baseline:
+                    self._baseline = slot.latency
+                else:
+                    self._baseline += (slot.latency - self._baseline) * 0.01
+
+                if slot.latency > max(LATENCY_FLOOR, self._baseline * LATENCY_FACTOR):
+                    self._decrease(now)
+                elif self.inflight + 1 >= int(self.window):
+                    # Only a window that is used up shows the server can take more.
+                    self.window = min(self.max_window, self.window + 1 / self.window)
+
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """
+        Wait for a slot and hold it while the attempt runs.
+
+        The attempt reports its latency and status with Slot.record; timeouts and
+        connection errors count as congestion.
+
+        :param deadline: time.monotonic() after which to give up waiting
+        :raises TimeoutError: if the deadline passed while waiting
+        """
+        self._acquire(current_priority(), deadline)
+        slot = Slot()
+
+        try:
+            yield slot
+        except OSError:
+            self._release(slot, True)
+            raise
+        except BaseException:
+            self._release(slot, False)
+            raise
+        else:
+            self._release(slot, False)
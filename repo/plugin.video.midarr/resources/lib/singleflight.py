@@ -0,0 +1,133 @@
+"""
+Single-flight coordination between plugin invocations.
+
+Kodi starts a separate process for every plugin call, and widgets on the home
+screen start several of them at once, often for the same listing. Whoever
+claims a key first does the work; the others wait for its marker file to
+disappear and then use the result it stored, instead of repeating the request.
+
+Markers are small files in a directory in the addon profile, holding the
+process id and a random nonce of their owner. Creating one with O_EXCL is
+atomic on every filesystem Kodi runs on, including Android.
+"""
+import hashlib
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+# Seconds a marker is trusted before its owner is considered dead, unless the
+# caller knows how long the work can take.
+DEFAULT_TIMEOUT = 30
+# Seconds between checks whether a marker is gone.
+POLL_INTERVAL = 0.02
+
+
+class SingleFlight:
+    """
+    Marker files for work in progress, one per key.
+
+    :param directory: marker directory, e.g. <profile>/inflight
+    :param timeout: seconds after which a marker is considered abandoned
+    """
+
+    def __init__(self, directory, timeout=DEFAULT_TIMEOUT):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.timeout = timeout
+        # Marker contents of the keys this process claimed.
+        self._owned = {}
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, path, owner):
+        # Only remove the marker if it still belongs to owner, another
+        # invocation may have claimed the key meanwhile.
+        if self._read(path) != owner:
+            return
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def claim(self, key):
+        """
+        Create the marker for a key.
+
+        :return: True if this process now owns the work for the key
+        :rtype: bool
+        """
+        owner = f'{os.getpid()} {uuid.uuid4().hex}'.encode('ascii')
+
+        try:
+            fd = os.open(self._path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        try:
+            os.write(fd, owner)
+        finally:
+            os.close(fd)
+
+        self._owned[key] = owner
+
+        return True
+
+    def release(self, key):
+        """
+        Remove the marker of a key this process claimed.
+        """
+        owner = self._owned.pop(key, None)
+
+        if owner is not None:
+            self._remove(self._path(key), owner)
+
+    def wait(self, key, timeout=None):
+        """
+        Wait while another invocation owns the work for a key.
+
+        :param timeout: seconds after which the marker is considered abandoned, defaults to the instance's
+        """
+        path = self._path(key)
+        timeout = self.timeout if timeout is None else timeout
+
+        while True:
+            try:
+                started = os.path.getmtime(path)
+            except FileNotFoundError:
+                return
+
+            if time.time() - started > timeout:
+                # The owner died without cleaning up.
+                self._remove(path, self._read(path))
+                return
+
+            time.sleep(POLL_INTERVAL)
+
+    @contextmanager
+    def lead(self, key, timeout=None):
+        """
+        Own the work for a key, waiting for the current owner first.
+
+        The previous owner may have done the work already, so look for its
+        result before doing the work again.
+
+        :param timeout: see wait, the longest the work can take
+        """
+        while not self.claim(key):
+            self.wait(key, timeout)
+
+        try:
+            yield
+        finally:
+            self.release(key)
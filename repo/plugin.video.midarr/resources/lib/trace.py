@@ -0,0 +1,217 @@
+"""
+Performance tracing for plugin invocations and library syncs.
+
+Spans are collected in memory and appended as JSON lines to a rotating file in
+the addon profile, one object per span::
+
+    {"trace": "3f9c0a1b2c4d", "span": 2, "parent": 1, "name": "api", "start_ms": 1.9,
+     "ms": 48.2, "thread": "MainThread", "path": "/api/movies?page", "status": 200, "bytes": 18231}
+
+The first line written by an invocation carries its context (addon version,
+Kodi build, platform), so traces from different devices and releases can be
+compared. Tracing is off by default and then costs one attribute lookup per span.
+"""
+import os
+import time
+
+# Size in bytes at which the trace file is rotated, and rotated files kept.
+MAX_BYTES = 1024 * 1024
+BACKUPS = 3
+
+
+class NullSpan:
+    """
+    Span of a disabled tracer.
+    """
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullTracer:
+    """
+    Tracer that records nothing.
+    """
+
+    enabled = False
+
+    def span(self, name, memory=False, **fields):
+        return NULL_SPAN
+
+    def flush(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+NULL_TRACER = NullTracer()
+
+
+class Span:
+    """
+    A timed operation, used as a context manager.
+
+    :param tracer: tracer recording the span
+    :param name: operation name, e.g. router, api, build
+    :param memory: record the peak Python memory allocated while the span was open
+    :param fields: attributes stored with the span
+    """
+
+    def __init__(self, tracer, name, memory, fields):
+        self.tracer = tracer
+        self.name = name
+        self.memory = memory
+        self.fields = fields
+        self.id = None
+        self.parent = None
+        self.started = None
+        self._tracemalloc = False
+
+    def set(self, **fields):
+        """
+        Add attributes that are only known once the operation ran, e.g. a status.
+        """
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.id = next(self.tracer._ids)
+        self.parent = stack[-1].id if stack else None
+        stack.append(self)
+
+        if self.memory:
+            import tracemalloc
+
+            # Leave tracemalloc alone if someone else already started it.
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc = True
+
+        self.started = time.monotonic()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        finished = time.monotonic()
+
+        if exc_type is not None:
+            self.fields['error'] = exc_type.__name__
+
+        if self.memory:
+            import tracemalloc
+
+            self.fields['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+
+            if self._tracemalloc:
+                tracemalloc.stop()
+
+        self.tracer._stack().remove(self)
+        self.tracer._record(self, finished)
+
+        return False
+
+
+class Tracer:
+    """
+    Records spans and appends them to a rotating JSON lines file.
+
+    :param path: trace file, rotated to path.1 .. path.N
+    :param context: attributes describing the invocation, written once
+    :param max_bytes: size at which the file is rotated
+    :param backups: rotated files kept
+    """
+
+    enabled = True
+
+    def __init__(self, path, context=None, max_bytes=MAX_BYTES, backups=BACKUPS):
+        import itertools
+        import threading
+
+        self.path = path
+        self.context = context or {}
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.trace_id = os.urandom(6).hex()
+        self._origin = time.monotonic()
+        self._ids = itertools.count(1)
+        self._records = [{'trace': self.trace_id, 'name': 'context', 'time': round(time.time(), 3),
+                          **self.context}]
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def span(self, name, memory=False, **fields):
+        """
+        Create a span, time it by using it as a context manager.
+
+        :rtype: Span
+        """
+        return Span(self, name, memory, fields)
+
+    def _stack(self):
+        # Open spans of the calling thread, the innermost one is the parent of new spans.
+        stack = getattr(self._local, 'stack', None)
+
+        if stack is None:
+            stack = self._local.stack = []
+
+        return stack
+
+    def _record(self, span, finished):
+        import threading
+
+        record = {
+            'trace': self.trace_id,
+            'span': span.id,
+            'parent': span.parent,
+            'name': span.name,
+            'start_ms': round((span.started - self._origin) * 1000, 2),
+            'ms': round((finished - span.started) * 1000, 2),
+            'thread': threading.current_thread().name,
+        }
+        record.update(span.fields)
+
+        with self._lock:
+            self._records.append(record)
+
+    def flush(self):
+        """
+        Append the spans recorded so far to the trace file.
+
+        Tracing never breaks the addon, write errors are ignored.
+        """
+        import json
+
+        with self._lock:
+            records, self._records = self._records, []
+
+            if not records:
+                return
+
+            lines = ''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in records)
+
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._rotate()
+
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(lines)
+            except OSError:
+                pass
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{number}'):
+                os.replace(f'{self.path}.{number}', f'{self.path}.{number + 1}')
+
+        os.replace(self.path, f'{self.path}.1')
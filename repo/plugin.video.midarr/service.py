@@ -0,0 +1,189 @@
+"""
+Background library sync, runs for the whole Kodi session.
+
+Movies and series are synced on a schedule, once Kodi has been idle for a
+while, and whenever the buttons in the addon settings ask for it. A sync never
+starts while something is playing and stops as soon as playback starts, so
+sync I/O does not compete with a stream.
+
+The service also runs the local artwork and stream proxy, see resources.lib.proxy.
+"""
+import json
+import os
+import time
+
+import xbmc
+import xbmcgui
+
+import addon
+from resources.lib.scheduler import BACKGROUND, set_default_priority
+
+ADDON_ID = 'plugin.video.midarr'
+# Seconds between checks whether a sync is due.
+POLL_INTERVAL = 5
+# Seconds before a failed scheduled sync is tried again.
+RETRY_INTERVAL = 15 * 60
+
+
+class SyncService(xbmc.Monitor):
+    """
+    Schedules library syncs and runs them in this long-lived process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Sync traffic yields to browsing, the proxy marks its own requests as foreground.
+        set_default_priority(BACKGROUND)
+        self.player = xbmc.Player()
+        # Media types the settings buttons asked for, see addon.request_sync.
+        self.requested = []
+        self.state_path = os.path.join(addon.get_profile(), 'sync.json')
+        self.last_sync = self._load_state()
+        self.last_attempt = {}
+        self.proxy = None
+        self.proxy_config = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+
+        with open(self.state_path, 'w', encoding='utf-8') as file:
+            json.dump(self.last_sync, file)
+
+    def onNotification(self, sender, method, data):
+        if sender != ADDON_ID or not method.startswith('Other.sync_'):
+            return
+
+        mediatype = method[len('Other.sync_'):]
+
+        if mediatype in addon.SYNC_JOBS and mediatype not in self.requested:
+            self.requested.append(mediatype)
+
+    def onSettingsChanged(self):
+        # Clients, caches and the tracer were built from the old settings,
+        # spans the old tracer still holds are written before it is dropped.
+        addon.get_tracer().flush()
+
+        for accessor in (addon.get_settings, addon.get_client, addon.get_cache, addon.get_artwork,
+                         addon.get_tracer, addon.get_scheduler):
+            accessor.cache_clear()
+
+        self.update_proxy()
+
+    def update_proxy(self):
+        """
+        Start, restart or stop the local proxy to match the settings.
+        """
+        settings = addon.get_settings()
+        streams = None
+
+        if settings.getBool('streamproxy'):
+            # Read-ahead window and head size in bytes.
+            streams = (settings.getInt('readahead') * 1024 * 1024, settings.getInt('streamhead') * 1024 * 1024)
+
+        enabled = settings.getBool('artproxy') or streams is not None
+        config = (settings.getInt('proxyport'), streams) if enabled else None
+
+        if config == self.proxy_config:
+            return
+
+        if self.proxy is not None:
+            xbmcgui.Window(10000).clearProperty(addon.PROXY_PROPERTY)
+            self.proxy.stop()
+            self.proxy = None
+
+        self.proxy_config = config
+
+        if config is None:
+            return
+
+        from resources.lib.proxy import LocalProxy
+        from resources.lib.readahead import Streams
+
+        port = config[0]
+
+        try:
+            # Accessors, not instances: the client and caches are rebuilt when the settings change.
+            self.proxy = LocalProxy(port, addon.get_client, addon.get_artwork,
+                                    os.path.join(addon.get_profile(), 'proxy'),
+                                    streams=Streams(os.path.join(addon.get_profile(), 'streams'), *streams)
+                                    if streams is not None else None, redirect_target=addon.redirect_target)
+        except OSError as e:
+            # Listings fall back to server URLs while the proxy is not published.
+            xbmc.log(f"Local proxy cannot listen on port {port}: {e}", xbmc.LOGERROR)
+            return
+
+        self.proxy.start()
+        xbmcgui.Window(10000).setProperty(addon.PROXY_PROPERTY, self.proxy.url)
+
+    def should_stop(self):
+        return self.abortRequested() or self.player.isPlaying()
+
+    def due(self, mediatype):
+        """
+        Whether the scheduled sync of a library is due and Kodi is idle enough to run it.
+        """
+        settings = addon.get_settings()
+        interval = settings.getInt('syncinterval')
+
+        if interval <= 0 or time.time() - self.last_sync.get(mediatype, 0) < interval * 3600:
+            return False
+
+        if time.time() - self.last_attempt.get(mediatype, 0) < RETRY_INTERVAL:
+            return False
+
+        return xbmc.getGlobalIdleTime() >= settings.getInt('syncidle') * 60
+
+    def sync(self, mediatype):
+        requested = mediatype in self.requested
+
+        if requested:
+            self.requested.remove(mediatype)
+
+        xbmc.log(f"Starting {mediatype} sync", xbmc.LOGINFO)
+        self.last_attempt[mediatype] = time.time()
+
+        if addon.run_sync(mediatype, stop=self.should_stop):
+            self.last_sync[mediatype] = time.time()
+            self._save_state()
+        elif requested and self.player.isPlaying():
+            # Interrupted by playback, run the requested sync once playback ended.
+            self.requested.append(mediatype)
+
+    def run(self):
+        self.update_proxy()
+
+        try:
+            while not self.waitForAbort(POLL_INTERVAL):
+                # Proxy spans are recorded in this process, they are written as they come in.
+                addon.get_tracer().flush()
+
+                if self.player.isPlaying():
+                    continue
+
+                for mediatype in addon.SYNC_JOBS:
+                    if self.should_stop():
+                        break
+
+                    if mediatype in self.requested or self.due(mediatype):
+                        try:
+                            self.sync(mediatype)
+                        except Exception as e:
+                            # The proxy runs in this process too, a failed sync must not stop it.
+                            xbmc.log(f"{mediatype.capitalize()} sync failed: {e}", xbmc.LOGERROR)
+        finally:
+            if self.proxy is not None:
+                xbmcgui.Window(10000).clearProperty(addon.PROXY_PROPERTY)
+                self.proxy.stop()
+
+            addon.get_tracer().flush()
+
+
+if __name__ == '__main__':
+    SyncService().run()